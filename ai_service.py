@@ -5,27 +5,72 @@ Supporte deux modèles NVIDIA :
 - qwen    : qwen/qwen3.5-397b-a17b (puissant, chat_template_kwargs)
 """
 
+import io
 import os
+import re
 import json
+import mmap
 import base64
+import logging
+import asyncio
+import tempfile
+import time
+import httpx
+import orjson
 import requests
+from blake3 import blake3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from PIL import Image as PILImage, ImageOps
 from dotenv import load_dotenv
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 INVOKE_URL = "https://integrate.api.nvidia.com/v1/chat/completions"
 
+# Shared session: keep-alive + connection pool (a single TLS handshake)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    # Completions are stateless: a POST can safely be retried on 502/503/504
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset({"POST"})),
+))
+
+# Above this size, images are encoded from an mmap (avoids the f.read() copy)
+MMAP_THRESHOLD = 1024 * 1024
+
+# Vision encoders work at ~1024 px: anything larger only costs bandwidth
+MAX_IMAGE_EDGE = 1280
+JPEG_QUALITY = 85
+
+# Disk cache of analyses (key: photo contents + prompt + model) and of encoded
+# photos. It holds users' photos and addresses, so it lives in an app-owned
+# directory (not the shared /tmp), owner-only (0o700), and entries are deleted
+# after AI_CACHE_MAX_AGE seconds.
+AI_CACHE_DIR = os.getenv("AI_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ai_cache"))
+AI_CACHE_MAX_AGE = int(os.getenv("AI_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+_PRUNE_INTERVAL = 3600  # seconds between two cache prunes in a process
+_last_prune = float("-inf")  # first write prunes immediately
+
 # ─── Model configs ─────────────────────────────────────────────────
 MODELS = {
     "nemotron": {
         "name": "nvidia/nemotron-nano-12b-v2-vl",
         "api_key_env": "NVIDIA_API_KEY_NEMOTRON",
         "label": "Rapide et Efficace",
+        "json_mode": True,   # honours response_format={"type": "json_object"}
     },
     "qwen": {
         "name": "qwen/qwen3.5-397b-a17b",
         "api_key_env": "NVIDIA_API_KEY",
         "label": "Lent et (accurate)",
+        "json_mode": True,
     },
 }
 
@@ -47,6 +92,11 @@ ALL_FIELDS = [
 ]
 
 
+def _count_fields(parsed: dict) -> int:
+    """Number of ALL_FIELDS with a truthy value (map/bool run in C)."""
+    return sum(map(bool, map(parsed.get, ALL_FIELDS)))
+
+
 def get_available_models():
     """Return dict of available models for UI."""
     return {k: v["label"] for k, v in MODELS.items()}
@@ -56,8 +106,9 @@ def get_default_model():
     return DEFAULT_MODEL
 
 
+@lru_cache(maxsize=8)
 def _get_model_config(model_key: str = None):
-    """Get model config by key."""
+    """Get model config by key (env is fixed once load_dotenv has run)."""
     key = model_key or DEFAULT_MODEL
     if key not in MODELS:
         key = DEFAULT_MODEL
@@ -67,16 +118,15 @@ def _get_model_config(model_key: str = None):
 
 
 # ─── API caller ────────────────────────────────────────────────────
-def _call_api(messages: list, max_tokens: int = 4096, temperature: float = 0.5,
-              model_key: str = None, think: bool = False) -> str:
-    """
-    Call NVIDIA API. Handles streaming and model-specific thinking modes.
-    """
+def _build_request(messages: list, max_tokens: int, temperature: float,
+                   model_key: str, think: bool, json_mode: bool = False,
+                   stream: bool = False) -> tuple[dict, dict]:
+    """Build headers + payload shared by the sync and async callers."""
     key, model_name, api_key = _get_model_config(model_key)
 
     headers = {
         "Authorization": f"Bearer {api_key}",
-        "Accept": "text/event-stream",
+        "Accept": "text/event-stream" if stream else "application/json",
         "Content-Type": "application/json",
     }
 
@@ -88,50 +138,128 @@ def _call_api(messages: list, max_tokens: int = 4096, temperature: float = 0.5,
         "top_p": 1,
         "frequency_penalty": 0,
         "presence_penalty": 0,
-        "stream": True,
+        "stream": stream,
     }
 
     # Qwen uses chat_template_kwargs for thinking
     if key == "qwen" and think:
         payload["chat_template_kwargs"] = {"enable_thinking": True}
 
-    print(f"[AI] Calling {model_name} (think={think})...")
+    # Constrained decoding: the model cannot emit anything but a JSON object
+    if json_mode and MODELS[key].get("json_mode"):
+        payload["response_format"] = {"type": "json_object"}
+
+    log.info("Calling %s (think=%s)", model_name, think)
+    return headers, payload
+
+
+def _delta_content(data_str) -> str:
+    """Content token of one SSE event payload ('' for reasoning or invalid chunks)."""
+    try:
+        data = orjson.loads(data_str)
+    except orjson.JSONDecodeError:
+        return ""
+    choices = data.get("choices", [])
+    if not choices:
+        return ""
+    delta = choices[0].get("delta", {})
+    # Skip thinking/reasoning tokens
+    if delta.get("reasoning_content"):
+        return ""
+    return delta.get("content", "") or ""
 
-    response = requests.post(INVOKE_URL, headers=headers, json=payload, stream=True)
+
+def _message_content(body: bytes) -> str:
+    """Final text of a non-streamed completion (reasoning is in a separate field)."""
+    return (orjson.loads(body)["choices"][0]["message"].get("content") or "").strip()
+
+
+def _call_api(messages: list, max_tokens: int = 4096, temperature: float = 0.5,
+              model_key: str = None, think: bool = False, json_mode: bool = False,
+              stream: bool = False) -> str:
+    """
+    Call NVIDIA API. Handles model-specific thinking modes.
+    json_mode requests server-side JSON output on models that support it.
+    Callers only need the final text, so the response is a single JSON body
+    unless stream=True (SSE, parsed token by token).
+    """
+    headers, payload = _build_request(messages, max_tokens, temperature, model_key,
+                                      think, json_mode, stream)
+
+    response = _SESSION.post(INVOKE_URL, headers=headers, json=payload, stream=stream)
     response.raise_for_status()
 
-    full_text = ""
+    if not stream:
+        return _message_content(response.content)
+
+    # One growable buffer for the whole stream instead of a str object per token
+    buf = bytearray()
 
     for line in response.iter_lines():
-        if not line:
+        # SSE envelopes are ASCII: stay on bytes, orjson decodes the payload
+        if not line or not line.startswith(b"data: "):
             continue
-        line_str = line.decode("utf-8")
-        if not line_str.startswith("data: "):
-            continue
-        data_str = line_str[6:]
-        if data_str.strip() == "[DONE]":
+        data_str = line[6:]
+        if data_str.strip() == b"[DONE]":
             break
-        try:
-            data = json.loads(data_str)
-            choices = data.get("choices", [])
-            if choices:
-                delta = choices[0].get("delta", {})
-                # Skip thinking/reasoning tokens
-                if delta.get("reasoning_content"):
-                    continue
-                content = delta.get("content", "")
-                if content:
-                    full_text += content
-        except json.JSONDecodeError:
-            continue
+        content = _delta_content(data_str)
+        if content:
+            buf += content.encode("utf-8")
+
+    return buf.decode("utf-8").strip()
+
 
-    return full_text.strip()
+def _async_client() -> httpx.AsyncClient:
+    """
+    HTTP/2 client: independent calls are multiplexed over one connection.
+    An AsyncClient is bound to its event loop, so callers own its lifetime
+    (`async with _async_client() as client: ...`).
+    """
+    # Non-streamed completions arrive in one piece: allow a long wait for the body
+    return httpx.AsyncClient(http2=True, timeout=httpx.Timeout(60.0, read=300.0))
+
+
+async def _call_api_async(messages: list, max_tokens: int = 4096, temperature: float = 0.5,
+                          model_key: str = None, think: bool = False, json_mode: bool = False,
+                          stream: bool = False, client: httpx.AsyncClient = None) -> str:
+    """Async variant of _call_api. Opens a one-off client if none is given."""
+    if client is None:
+        async with _async_client() as own_client:
+            return await _call_api_async(messages, max_tokens, temperature, model_key,
+                                         think, json_mode, stream, client=own_client)
+
+    headers, payload = _build_request(messages, max_tokens, temperature, model_key,
+                                      think, json_mode, stream)
+
+    if not stream:
+        response = await client.post(INVOKE_URL, headers=headers, json=payload)
+        response.raise_for_status()
+        return _message_content(response.content)
+
+    buf = bytearray()
+
+    async with client.stream("POST", INVOKE_URL, headers=headers, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data_str = line[6:]
+            if data_str.strip() == "[DONE]":
+                break
+            content = _delta_content(data_str)
+            if content:
+                buf += content.encode("utf-8")
+
+    return buf.decode("utf-8").strip()
 
 
 # ─── Image encoding ───────────────────────────────────────────────
 def _read_image_b64(path: str) -> str:
     with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode()
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return base64.b64encode(mm).decode("ascii")
+        return base64.b64encode(f.read()).decode("ascii")
 
 
 def _get_mime(path: str) -> str:
@@ -140,7 +268,67 @@ def _get_mime(path: str) -> str:
             "webp": "image/webp"}.get(ext, "image/jpeg")
 
 
+def _encode_image(path: str) -> str:
+    """
+    Data URL of the photo downscaled to MAX_IMAGE_EDGE and re-encoded as JPEG.
+    Unreadable formats are sent as-is.
+    """
+    try:
+        with PILImage.open(path) as img:
+            img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), PILImage.Resampling.LANCZOS)
+            # Re-encoding drops EXIF: bake the orientation into the pixels
+            img = ImageOps.exif_transpose(img)
+            buf = io.BytesIO()
+            img.convert("RGB").save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    except (OSError, ValueError):
+        return f"data:{_get_mime(path)};base64,{_read_image_b64(path)}"
+    return f"data:image/jpeg;base64,{base64.b64encode(buf.getbuffer()).decode('ascii')}"
+
+
+def _encoded_image_cache_path(path: str) -> str:
+    """Disk cache entry for a photo: BLAKE3 of its bytes plus the encoding settings."""
+    h = blake3()
+    h.update_mmap(path)
+    h.update(f"\0{MAX_IMAGE_EDGE}:{JPEG_QUALITY}".encode())
+    return os.path.join(AI_CACHE_DIR, "img", f"{h.hexdigest(length=16)}.txt")
+
+
+@lru_cache(maxsize=64)
+def _encode_image_cached(path: str, mtime: int, size: int) -> str:
+    """
+    Memoized _encode_image — mtime/size in the key invalidate modified files.
+    Misses fall back to the disk cache, shared across processes and restarts,
+    so re-uploads of the same photo are not resized and re-encoded again.
+    """
+    cache_path = _encoded_image_cache_path(path)
+    try:
+        with open(cache_path, "rb") as f:
+            return f.read().decode("ascii")
+    except OSError:
+        pass
+    url = _encode_image(path)
+    _write_cache_file(cache_path, url.encode("ascii"))
+    return url
+
+
+def _image_url(path: str) -> str:
+    st = os.stat(path)
+    return _encode_image_cached(path, st.st_mtime_ns, st.st_size)
+
+
+def _encode_images(paths: list) -> list:
+    """Read + encode several images concurrently (I/O and PIL release the GIL)."""
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(16, len(paths))) as ex:
+        urls = list(ex.map(_image_url, paths))
+    return [{"type": "image_url", "image_url": {"url": url}} for url in urls]
+
+
 # ─── JSON extraction ──────────────────────────────────────────────
+_JSON_DECODER = json.JSONDecoder()
+
+
 def _extract_json(text: str) -> dict | None:
     """Robustly extract JSON from AI response."""
     cleaned = text.strip()
@@ -161,61 +349,95 @@ def _extract_json(text: str) -> dict | None:
 
     # Direct parse
     try:
-        return _flatten_json(json.loads(cleaned))
-    except (json.JSONDecodeError, ValueError):
+        return _flatten_json(orjson.loads(cleaned))
+    except (orjson.JSONDecodeError, ValueError):
         pass
 
-    # Find { ... } with brace matching
+    # Decode the first { ... } object in place: raw_decode runs the C scanner
+    # and stops at the matching brace, ignoring any trailing text
     start = cleaned.find("{")
     if start != -1:
-        depth = 0
-        for i in range(start, len(cleaned)):
-            if cleaned[i] == "{":
-                depth += 1
-            elif cleaned[i] == "}":
-                depth -= 1
-                if depth == 0:
-                    try:
-                        return _flatten_json(json.loads(cleaned[start:i + 1]))
-                    except (json.JSONDecodeError, ValueError):
-                        pass
-                    break
+        try:
+            return _flatten_json(_JSON_DECODER.raw_decode(cleaned, start)[0])
+        except ValueError:
+            pass
+
+        # Response cut off by max_tokens: keep the complete leading fields
+        # rather than paying for a fallback API call
+        salvaged = _salvage_truncated_json(cleaned[start:])
+        if salvaged and _count_fields(salvaged) >= 5:
+            log.info("Truncated JSON salvaged")
+            return salvaged
 
     return None
 
 
+# Complete strings, a trailing unterminated string, or structural characters
+_JSON_TOKEN_RE = re.compile(r'"(?:\\.|[^"\\])*(?:"|\Z)|[{}\[\],]')
+
+
+def _salvage_truncated_json(text: str) -> dict | None:
+    """Close a truncated JSON object after its last complete member."""
+    closers = []
+    cut = None
+    for m in _JSON_TOKEN_RE.finditer(text):
+        tok = m.group()
+        if tok == "{":
+            closers.append("}")
+        elif tok == "[":
+            closers.append("]")
+        elif tok in "}]":
+            if not closers:
+                return None
+            closers.pop()
+        elif tok == ",":
+            cut = text[:m.start()] + "".join(reversed(closers))
+    if cut is None:
+        return None
+    try:
+        data = orjson.loads(cut)
+    except orjson.JSONDecodeError:
+        return None
+    return _flatten_json(data) if isinstance(data, dict) else None
+
+
 def _flatten_json(data: dict) -> dict:
     """Flatten nested group headers into flat keys."""
+    # Common case (the prompt asks for a flat object): no copy
+    if not any(isinstance(value, dict) for value in data.values()):
+        return data
     flat = {}
     for key, value in data.items():
         if isinstance(value, dict):
-            for inner_key, inner_value in value.items():
-                flat[inner_key] = inner_value
+            flat.update(value)
         else:
             flat[key] = value
     return flat
 
 
-# ─── The JSON-forcing prompt ──────────────────────────────────────
-def _build_analysis_prompt(n_avant: int, n_apres: int, projet_info: dict = None) -> str:
-    """Build the advanced architectural analysis prompt."""
-    context = ""
-    if projet_info:
-        context = f"""
-INFORMATIONS DU PROJET :
-- Adresse : {projet_info.get('adresse', 'Non renseigné')}
-- Commune : {projet_info.get('commune', 'Non renseigné')} ({projet_info.get('code_postal', '')})
-- Zone PLU : {projet_info.get('zone_plu', '')}
-- Type : {projet_info.get('type_travaux', 'Non renseigné')}
-- Description : {projet_info.get('description', 'Non renseigné')}
-- Surface déclarée : {projet_info.get('surface_existante', '')} m²
-"""
+def _extract_json_list(text: str) -> list | None:
+    """Extract a JSON array from an AI response (markdown fences tolerated)."""
+    cleaned = text.strip()
+    start, end = cleaned.find("["), cleaned.rfind("]")
+    if start == -1 or end < start:
+        return None
+    try:
+        data = orjson.loads(cleaned[start:end + 1])
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, list) else None
+
 
-    return f"""Analyse ces {n_avant + n_apres} photos avec une précision architecturale et réglementaire maximale.
+# ─── The JSON-forcing prompt ──────────────────────────────────────
+# Static segments, built once; only the photo counts, the context block and
+# the PLU zone vary per call and are interleaved by _build_analysis_prompt
+_PROMPT_HEAD = """Analyse ces {n_total} photos avec une précision architecturale et réglementaire maximale.
 
 Les {n_avant} premières images correspondent à l'ÉTAT EXISTANT (avant). 
 Les {n_apres} dernières images correspondent à l'ÉTAT PROJETÉ (après).
-{context}
+"""
+
+_PROMPT_MIDDLE = """
 MISSION CRUCIALE :
 Compare minutieusement l'avant et l'après.
 Identifie CHAQUE modification physique visible.
@@ -232,13 +454,15 @@ Détecte explicitement :
 - Modification de l'emprise au sol
 - Modification estimée de la surface de plancher
 
-Évalue la cohérence architecturale avec un environnement résidentiel urbain typique d'une zone {projet_info.get('zone_plu', 'UB') if projet_info else 'UB'}.
+Évalue la cohérence architecturale avec un environnement résidentiel urbain typique d'une zone """
+
+_PROMPT_TAIL = """.
 Signale tout risque réglementaire potentiel.
 Si un élément n'est pas clairement identifiable visuellement, indique "non déterminable visuellement".
 Pour chaque détection matérielle ou colorimétrique, indique un niveau de confiance (faible, moyen, élevé).
 
 Retourne un objet JSON PLAT avec EXACTEMENT ces clés au premier niveau :
-{{
+{
   "etat_initial": "...",
   "etat_projete": "...",
   "modifications_detaillees": "...",
@@ -265,31 +489,40 @@ Retourne un objet JSON PLAT avec EXACTEMENT ces clés au premier niveau :
   "couleur_volets": "... (RAL estimé si possible + confiance)",
   "couleur_toiture": "... (RAL estimé si possible + confiance)",
   "niveau_confiance_global": "..."
-}}
+}
 
 RÈGLES STRICTES :
 - Réponds UNIQUEMENT avec le JSON.
 - PAS de sous-objets.
-- COMMENCE par {{ et FINIS par }}.
+- COMMENCE par { et FINIS par }.
 - PAS de texte avant ou après."""
 
 
-# ─── Main analysis function ───────────────────────────────────────
-def analyser_photos(photos_avant: list, photos_apres: list,
-                    projet_info: dict = None, model_key: str = None) -> dict:
-    """
-    Analyse photos and return a flat dict with all 15 fields.
-    Uses system message + /no_think (nemotron) or no-thinking mode (qwen).
-    If parsing fails, makes a second call to convert text to JSON.
-    """
-    key, model_name, api_key = _get_model_config(model_key)
-    all_photos = photos_avant + photos_apres
-    n_avant = len(photos_avant)
-    n_apres = len(photos_apres)
+def _build_analysis_prompt(n_avant: int, n_apres: int, projet_info: dict = None) -> str:
+    """Build the advanced architectural analysis prompt."""
+    context = ""
+    if projet_info:
+        context = f"""
+INFORMATIONS DU PROJET :
+- Adresse : {projet_info.get('adresse', 'Non renseigné')}
+- Commune : {projet_info.get('commune', 'Non renseigné')} ({projet_info.get('code_postal', '')})
+- Zone PLU : {projet_info.get('zone_plu', '')}
+- Type : {projet_info.get('type_travaux', 'Non renseigné')}
+- Description : {projet_info.get('description', 'Non renseigné')}
+- Surface déclarée : {projet_info.get('surface_existante', '')} m²
+"""
 
-    prompt = _build_analysis_prompt(n_avant, n_apres, projet_info)
+    zone_plu = projet_info.get('zone_plu', 'UB') if projet_info else 'UB'
+    return "".join([
+        _PROMPT_HEAD.format(n_total=n_avant + n_apres, n_avant=n_avant, n_apres=n_apres),
+        context, _PROMPT_MIDDLE, str(zone_plu), _PROMPT_TAIL,
+    ])
 
-    # ── Build messages ──
+
+# ─── Main analysis function ───────────────────────────────────────
+def _build_analysis_messages(photos_avant: list, photos_apres: list,
+                             prompt: str, key: str) -> list:
+    """System + user messages (images then prompt) for the photo analysis."""
     # System message: /no_think for nemotron, plain instruction for qwen
     if key == "nemotron":
         system_content = "/no_think\nTu es un expert en urbanisme français. Réponds UNIQUEMENT en JSON."
@@ -297,43 +530,158 @@ def analyser_photos(photos_avant: list, photos_apres: list,
         system_content = "Tu es un expert en urbanisme français. Réponds UNIQUEMENT en JSON valide. Commence par { et finis par }."
 
     # User message with images
-    user_content = []
-    for path in all_photos:
-        b64 = _read_image_b64(path)
-        mime = _get_mime(path)
-        user_content.append({
-            "type": "image_url",
-            "image_url": {"url": f"data:{mime};base64,{b64}"}
-        })
+    user_content = _encode_images(photos_avant + photos_apres)
     user_content.append({"type": "text", "text": prompt})
 
-    messages = [
+    return [
         {"role": "system", "content": system_content},
         {"role": "user", "content": user_content},
     ]
 
-    # Call WITHOUT thinking to get clean JSON
-    result = _call_api(messages, max_tokens=4096, temperature=0.3,
-                       model_key=key, think=False)
 
-    print(f"[AI] Response: {len(result)} chars")
-    print(f"[AI] Preview: {result[:300]}")
+def _parse_analysis(result: str, projet_info: dict, key: str) -> dict:
+    """Parse the analysis response, falling back to a text→JSON call."""
+    log.debug("Response: %d chars", len(result))
+    log.debug("Preview: %s", result[:300])
 
     # Try to parse
     parsed = _extract_json(result)
 
     if parsed:
-        found = sum(1 for k in ALL_FIELDS if parsed.get(k))
-        print(f"[AI] ✓ Parsed {found}/{len(ALL_FIELDS)} fields")
-        if found >= 5:
+        found = _count_fields(parsed)
+        log.info("Parsed %d/%d fields", found, len(ALL_FIELDS))
+        # JSON-mode output is already structured: a re-formatting call cannot add fields
+        if found >= 5 or MODELS[key].get("json_mode"):
             return parsed
-        print(f"[AI] Only {found} fields — trying fallback...")
+        log.warning("Only %d fields — trying fallback", found)
 
     # ── FALLBACK: text-to-JSON conversion ──
-    print(f"[AI] Primary parse failed. Running text→JSON fallback...")
+    log.warning("Primary parse failed. Running text→JSON fallback")
     return _text_to_json(result, projet_info, model_key=key)
 
 
+# ─── Analysis cache ───────────────────────────────────────────────
+def _analysis_cache_key(photos: list, prompt: str, model_name: str) -> str:
+    """BLAKE3 (SIMD) of the photo bytes (in order), the prompt and the model."""
+    h = blake3()
+    for path in photos:
+        # Hashes straight from a memory map, without reading the file into bytes
+        h.update_mmap(path)
+        h.update(b"\0")
+    h.update(prompt.encode())
+    h.update(b"\0")
+    h.update(model_name.encode())
+    return h.hexdigest(length=16)
+
+
+def _lookup_analysis(photos: list, prompt: str, model_name: str) -> tuple[str, dict | None]:
+    """Return (cache_key, cached analysis or None)."""
+    cache_key = _analysis_cache_key(photos, prompt, model_name)
+    try:
+        with open(os.path.join(AI_CACHE_DIR, f"{cache_key}.json"), "rb") as f:
+            return cache_key, orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return cache_key, None
+
+
+def _prune_cache():
+    """Delete cache entries older than AI_CACHE_MAX_AGE (at most once per _PRUNE_INTERVAL)."""
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < _PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    cutoff = time.time() - AI_CACHE_MAX_AGE
+    for directory in (AI_CACHE_DIR, os.path.join(AI_CACHE_DIR, "img")):
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+        except OSError as e:
+            log.warning("Cache prune failed: %s", e)
+
+
+def _write_cache_file(path: str, data: bytes):
+    """Best-effort atomic write of a cache entry (owner-only directory and file)."""
+    tmp_path = None
+    try:
+        os.makedirs(AI_CACHE_DIR, mode=0o700, exist_ok=True)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # mkstemp: file created 0o600 with a unique name (concurrent writers of one entry)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning("Cache write failed: %s", e)
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    _prune_cache()
+
+
+def _store_analysis(cache_key: str, parsed: dict):
+    """Best-effort write; degraded results are not cached so they get retried."""
+    if _count_fields(parsed) < 5:
+        return
+    _write_cache_file(os.path.join(AI_CACHE_DIR, f"{cache_key}.json"), orjson.dumps(parsed))
+
+
+def analyser_photos(photos_avant: list, photos_apres: list,
+                    projet_info: dict = None, model_key: str = None) -> dict:
+    """
+    Analyse photos and return a flat dict with all 15 fields.
+    Uses system message + /no_think (nemotron) or no-thinking mode (qwen).
+    If parsing fails, makes a second call to convert text to JSON.
+    Results are cached on disk by (photo contents, prompt, model).
+    """
+    key, model_name, _ = _get_model_config(model_key)
+    prompt = _build_analysis_prompt(len(photos_avant), len(photos_apres), projet_info)
+
+    cache_key, cached = _lookup_analysis(photos_avant + photos_apres, prompt, model_name)
+    if cached is not None:
+        log.info("Analysis cache hit")
+        return cached
+
+    messages = _build_analysis_messages(photos_avant, photos_apres, prompt, key)
+
+    # Call WITHOUT thinking to get clean JSON
+    result = _call_api(messages, max_tokens=4096, temperature=0.3,
+                       model_key=key, think=False, json_mode=True)
+
+    parsed = _parse_analysis(result, projet_info, key)
+    _store_analysis(cache_key, parsed)
+    return parsed
+
+
+async def analyser_photos_async(photos_avant: list, photos_apres: list,
+                                projet_info: dict = None, model_key: str = None,
+                                client: httpx.AsyncClient = None) -> dict:
+    """Async variant of analyser_photos (shares `client` with concurrent calls)."""
+    key, model_name, _ = _get_model_config(model_key)
+    prompt = _build_analysis_prompt(len(photos_avant), len(photos_apres), projet_info)
+
+    # Hashing, image encoding and the rare fallback call are blocking: keep them off the loop
+    cache_key, cached = await asyncio.to_thread(_lookup_analysis, photos_avant + photos_apres,
+                                                prompt, model_name)
+    if cached is not None:
+        log.info("Analysis cache hit")
+        return cached
+
+    messages = await asyncio.to_thread(_build_analysis_messages,
+                                       photos_avant, photos_apres, prompt, key)
+
+    result = await _call_api_async(messages, max_tokens=4096, temperature=0.3,
+                                   model_key=key, think=False, json_mode=True, client=client)
+
+    parsed = await asyncio.to_thread(_parse_analysis, result, projet_info, key)
+    await asyncio.to_thread(_store_analysis, cache_key, parsed)
+    return parsed
+
+
 def _text_to_json(raw_text: str, projet_info: dict = None,
                   model_key: str = None) -> dict:
     """Convert plain text to structured JSON via a second API call."""
@@ -366,17 +714,17 @@ Commence par {{ et finis par }}. RIEN d'autre."""
     ]
 
     result = _call_api(messages, max_tokens=4096, temperature=0.1,
-                       model_key=key, think=False)
+                       model_key=key, think=False, json_mode=True)
 
-    print(f"[AI] Fallback response: {len(result)} chars")
+    log.debug("Fallback response: %d chars", len(result))
 
     parsed = _extract_json(result)
     if parsed:
-        found = sum(1 for k in ALL_FIELDS if parsed.get(k))
-        print(f"[AI] ✓ Fallback parsed {found}/{len(ALL_FIELDS)} fields")
+        found = _count_fields(parsed)
+        log.info("Fallback parsed %d/%d fields", found, len(ALL_FIELDS))
         return parsed
 
-    print("[AI] ✗ Fallback also failed. Returning raw text in etat_initial.")
+    log.warning("Fallback also failed. Returning raw text in etat_initial")
     result_dict = {k: "" for k in ALL_FIELDS}
     result_dict["etat_initial"] = raw_text[:500]
     return result_dict
@@ -414,7 +762,7 @@ Commence par {{ — RIEN d'autre."""
     ]
 
     result = _call_api(messages, max_tokens=4096, temperature=0.4,
-                       model_key=key, think=False)
+                       model_key=key, think=False, json_mode=True)
 
     parsed = _extract_json(result)
     if parsed:
@@ -424,19 +772,80 @@ Commence par {{ — RIEN d'autre."""
 
 
 # ─── Photo description (single photo) ─────────────────────────────
-def generer_description_photo(photo_path: str, est_avant: bool = True,
-                              model_key: str = None) -> str:
-    """Generate a description for a single photo."""
+def _build_description_messages(photo_path: str, est_avant: bool) -> list:
     etat = "existant (avant travaux)" if est_avant else "projeté (après travaux)"
 
-    b64 = _read_image_b64(photo_path)
-    mime = _get_mime(photo_path)
-
-    messages = [
+    return [
         {"role": "user", "content": [
-            {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}},
+            {"type": "image_url", "image_url": {"url": _image_url(photo_path)}},
             {"type": "text", "text": f"Décris brièvement cette photo d'un bâtiment dans son état {etat} pour un dossier de Déclaration Préalable. Factuel et professionnel, 1-2 phrases."}
         ]}
     ]
 
+
+def generer_description_photo(photo_path: str, est_avant: bool = True,
+                              model_key: str = None) -> str:
+    """Generate a description for a single photo."""
+    messages = _build_description_messages(photo_path, est_avant)
     return _call_api(messages, max_tokens=512, temperature=0.3, model_key=model_key)
+
+
+async def generer_description_photo_async(photo_path: str, est_avant: bool = True,
+                                          model_key: str = None,
+                                          client: httpx.AsyncClient = None) -> str:
+    """
+    Async variant of generer_description_photo. Describe several photos
+    concurrently over a single HTTP/2 connection with:
+
+        async with _async_client() as client:
+            await asyncio.gather(*(generer_description_photo_async(p, client=client)
+                                   for p in paths))
+    """
+    messages = await asyncio.to_thread(_build_description_messages, photo_path, est_avant)
+    return await _call_api_async(messages, max_tokens=512, temperature=0.3,
+                                 model_key=model_key, client=client)
+
+
+# ─── Photo descriptions (batch, single call) ──────────────────────
+def generer_descriptions_photos(paths: list, est_avant_flags: list,
+                                model_key: str = None) -> list:
+    """
+    Describe N photos with a single multi-image API call.
+    Falls back to one call per photo if the JSON array cannot be parsed.
+    """
+    if not paths:
+        return []
+    key, _, _ = _get_model_config(model_key)
+    n = len(paths)
+
+    etats = "\n".join(
+        f"- Photo {i + 1} : état {'existant (avant travaux)' if avant else 'projeté (après travaux)'}"
+        for i, avant in enumerate(est_avant_flags)
+    )
+
+    if key == "nemotron":
+        sys_content = "/no_think\nTu es un expert en urbanisme. Réponds UNIQUEMENT en JSON."
+    else:
+        sys_content = "Tu es un expert en urbanisme. Réponds UNIQUEMENT en JSON valide."
+
+    user_content = _encode_images(paths)
+    user_content.append({"type": "text", "text": f"""Décris brièvement chacune de ces {n} photos d'un bâtiment pour un dossier de Déclaration Préalable. Factuel et professionnel, 1-2 phrases par photo.
+{etats}
+
+Retourne un tableau JSON de {n} chaînes, dans l'ordre des photos. Commence par [ et finis par ]. RIEN d'autre."""})
+
+    messages = [
+        {"role": "system", "content": sys_content},
+        {"role": "user", "content": user_content},
+    ]
+
+    result = _call_api(messages, max_tokens=min(4096, 512 * n), temperature=0.3,
+                       model_key=key, think=False)
+
+    descriptions = _extract_json_list(result)
+    if descriptions and len(descriptions) == n:
+        return [str(d).strip() for d in descriptions]
+
+    log.warning("Batch descriptions unparsable — falling back to %d single calls", n)
+    return [generer_description_photo(p, avant, model_key=key)
+            for p, avant in zip(paths, est_avant_flags)]
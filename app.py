@@ -6,96 +6,254 @@ Flux : Identité/Lieu → Type de travaux → Photos (paires avant/après) → A
 import os
 import io
 import json
+import hashlib
+import logging
+import shutil
+import threading
+import time
 import uuid
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, fields
 from datetime import date
+from functools import partial
 from flask import (
     Flask, render_template, request, session, redirect,
-    url_for, send_file, flash, jsonify, Response, make_response
+    url_for, send_file, flash, jsonify, Response, make_response, g
 )
+from flask.json.provider import DefaultJSONProvider
+from flask_session import Session
+from jinja2 import FileSystemBytecodeCache
+import orjson
+import redis
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# INFO en développement, WARNING en production (surchargeable via LOG_LEVEL)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO" if os.getenv("FLASK_DEBUG", "false").lower() == "true" else "WARNING"),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+)
+
 from models import (
     DeclarationPrealable, Demandeur, Terrain, TravauxDetail,
-    AspectExterieur, NoticeDescriptive, PhotoSet, get_dummy_declaration
+    AspectExterieur, NoticeDescriptive, PhotoSet, get_dummy_declaration,
+    NOTICE_FIELDS, ASPECT_FIELDS
+)
+from ai_service import (
+    analyser_photos, generer_notice_descriptive, generer_description_photo,
+    get_available_models, get_default_model, _build_analysis_prompt
 )
-from ai_service import analyser_photos, generer_notice_descriptive, generer_description_photo, get_available_models, get_default_model
 from pdf_generator import generer_pdf
 
+log = logging.getLogger(__name__)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Sérialisation JSON via orjson (réponses API, cookie de session)."""
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # orjson produit déjà des bytes : pas de passage par str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype,
+        )
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-key")
 
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
 OUTPUT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JINJA_CACHE_FOLDER = os.path.join(BASE_DIR, ".jinja_cache")
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(JINJA_CACHE_FOLDER, exist_ok=True)
+
+# Templates compilés une fois : bytecode persistant entre redémarrages / workers à froid
+app.jinja_env.auto_reload = os.getenv("FLASK_DEBUG", "false").lower() == "true"
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_FOLDER)
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+# Sessions côté serveur si Redis est configuré : le cookie ne porte plus qu'un
+# identifiant au lieu de toute la DP signée (HMAC + base64 à chaque requête).
+# La même connexion porte l'état des analyses IA partagé entre workers.
+_redis = redis.Redis.from_url(os.environ["REDIS_URL"]) if os.getenv("REDIS_URL") else None
+if _redis is not None:
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = _redis
+    Session(app)
+
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'webp'})
+
+# Copie des uploads par gros blocs : quelques write() par photo au lieu de
+# centaines avec le tampon de 16 Ko de FileStorage.save()
+UPLOAD_COPY_CHUNK = 2 * 1024 * 1024
+UPLOAD_WRITE_BUFFER = 4 * 1024 * 1024
 
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return os.path.splitext(filename)[1][1:].lower() in ALLOWED_EXTENSIONS
+
+
+def _save_upload(file_storage, path):
+    """Écrit un fichier uploadé sur disque avec un tampon large."""
+    with open(path, "wb", buffering=UPLOAD_WRITE_BUFFER) as out:
+        shutil.copyfileobj(file_storage.stream, out, length=UPLOAD_COPY_CHUNK)
+
+
+def _store_upload(file_storage):
+    """Enregistre un upload sous un nom dérivé de son contenu et retourne le chemin.
+
+    Le nom d'origine n'est utilisé que pour l'extension (déjà validée par
+    allowed_file) ; une photo déjà reçue (retour arrière, ré-envoi) n'est pas
+    réécrite, quel que soit son nom.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    stream = file_storage.stream
+    while chunk := stream.read(1 << 20):
+        h.update(chunk)
+    stream.seek(0)
+
+    # Pas de secure_filename : il retire les caractères non ASCII (« фото.jpg » perdait
+    # son extension) ; le nom stocké est le hash, seule l'extension autorisée est gardée
+    ext = os.path.splitext(file_storage.filename)[1].lower()
+    if ext[1:] not in ALLOWED_EXTENSIONS:
+        ext = ""
+    path = os.path.join(UPLOAD_FOLDER, f"{h.hexdigest()}{ext}")
+    if not os.path.exists(path):
+        # Fichier temporaire + rename atomique : deux uploads identiques du même
+        # envoi peuvent viser le même chemin depuis deux threads
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.part"
+        _save_upload(file_storage, tmp)
+        os.replace(tmp, path)
+    return path
 
 
 # ─── Helper: session ↔ model conversion ───────────────────────────
-def _session_to_dp() -> DeclarationPrealable:
-    """Reconstruit un objet DeclarationPrealable depuis la session."""
-    data = session.get("dp_data", {})
-    dp = DeclarationPrealable()
-
-    if "demandeur" in data:
-        for k, v in data["demandeur"].items():
-            if hasattr(dp.demandeur, k):
-                setattr(dp.demandeur, k, v)
+# Sous-objets de la DP et leurs champs connus, calculés une fois à l'import
+_DP_SECTIONS = {
+    name: (cls, frozenset(f.name for f in fields(cls)))
+    for name, cls in (
+        ("demandeur", Demandeur),
+        ("terrain", Terrain),
+        ("travaux", TravauxDetail),
+        ("aspect_exterieur", AspectExterieur),
+        ("notice", NoticeDescriptive),
+    )
+}
+_DP_SCALARS = ("reference", "date_creation", "pieces_jointes")
+# Ordre des champs de PhotoSet (tous des chaînes) pour une construction positionnelle
+_PS_KEYS = tuple(f.name for f in fields(PhotoSet))
 
-    if "terrain" in data:
-        for k, v in data["terrain"].items():
-            if hasattr(dp.terrain, k):
-                setattr(dp.terrain, k, v)
 
-    if "travaux" in data:
-        for k, v in data["travaux"].items():
-            if hasattr(dp.travaux, k):
-                setattr(dp.travaux, k, v)
+def _session_to_dp() -> DeclarationPrealable:
+    """Reconstruit un objet DeclarationPrealable depuis la session.
 
-    if "aspect_exterieur" in data:
-        for k, v in data["aspect_exterieur"].items():
-            if hasattr(dp.aspect_exterieur, k):
-                setattr(dp.aspect_exterieur, k, v)
+    Le résultat est mémorisé sur `g` : les appels suivants dans la même
+    requête partagent le même objet au lieu de re-désérialiser la session.
+    """
+    dp = g.get("_dp")
+    if dp is not None:
+        return dp
 
-    if "notice" in data:
-        for k, v in data["notice"].items():
-            if hasattr(dp.notice, k):
-                setattr(dp.notice, k, v)
+    data = session.get("dp_data", {})
 
+    kwargs = {
+        name: cls(**{k: v for k, v in data[name].items() if k in known})
+        for name, (cls, known) in _DP_SECTIONS.items()
+        if name in data
+    }
+    kwargs.update((k, data[k]) for k in _DP_SCALARS if k in data)
     if "photo_sets" in data:
-        dp.photo_sets = [PhotoSet(**ps) for ps in data["photo_sets"]]
-
-    if "reference" in data:
-        dp.reference = data["reference"]
-    if "date_creation" in data:
-        dp.date_creation = data["date_creation"]
+        kwargs["photo_sets"] = [PhotoSet(*(ps.get(k, "") for k in _PS_KEYS)) for ps in data["photo_sets"]]
 
-    return dp
+    g._dp = DeclarationPrealable(**kwargs)
+    return g._dp
 
 
 def _dp_to_session(dp: DeclarationPrealable):
     """Sérialise un objet DeclarationPrealable vers la session."""
-    data = {
-        "demandeur": dp.demandeur.__dict__,
-        "terrain": dp.terrain.__dict__,
-        "travaux": dp.travaux.__dict__,
-        "aspect_exterieur": dp.aspect_exterieur.__dict__,
-        "notice": dp.notice.__dict__,
-        "photo_sets": [ps.__dict__ for ps in dp.photo_sets],
-        "reference": dp.reference,
-        "date_creation": dp.date_creation,
-    }
-    session["dp_data"] = data
+    session["dp_data"] = asdict(dp)
+    g._dp = dp
+
+
+# ─── Helper: formulaires → modèle ─────────────────────────────────
+# (clé du formulaire, attribut du modèle) ; un champ absent du formulaire garde sa valeur
+_STEP1_DEMANDEUR_FIELDS = (
+    ("civilite", "civilite"),
+    ("nom", "nom"),
+    ("prenom", "prenom"),
+    ("date_naissance", "date_naissance"),
+    ("lieu_naissance", "lieu_naissance"),
+    ("adresse_demandeur", "adresse"),
+    ("cp_demandeur", "code_postal"),
+    ("ville_demandeur", "ville"),
+    ("telephone", "telephone"),
+    ("email", "email"),
+    ("qualite", "qualite"),
+)
+_STEP1_TERRAIN_FIELDS = (
+    ("adresse_terrain", "adresse"),
+    ("lieu_dit", "lieu_dit"),
+    ("cp_terrain", "code_postal"),
+    ("commune", "commune"),
+    ("section_cadastrale", "section_cadastrale"),
+    ("numero_parcelle", "numero_parcelle"),
+    ("superficie_terrain", "superficie_terrain"),
+    ("zone_plu", "zone_plu"),
+)
+_STEP2_TRAVAUX_FIELDS = (
+    ("type_travaux", "type_travaux"),
+    ("description_courte", "description_courte"),
+    ("surface_plancher_existante", "surface_plancher_existante"),
+    ("surface_plancher_creee", "surface_plancher_creee"),
+    ("emprise_au_sol_existante", "emprise_au_sol_existante"),
+    ("emprise_au_sol_creee", "emprise_au_sol_creee"),
+    ("hauteur_existante", "hauteur_existante"),
+    ("hauteur_projetee", "hauteur_projetee"),
+    ("date_debut_prevue", "date_debut_prevue"),
+    ("duree_travaux_mois", "duree_travaux_mois"),
+)
+
+# Conversions numériques ; une saisie vide vaut 0 (1 mois pour la durée)
+_FLOAT_FIELDS = frozenset({
+    "superficie_terrain",
+    "surface_plancher_existante", "surface_plancher_creee",
+    "emprise_au_sol_existante", "emprise_au_sol_creee",
+    "hauteur_existante", "hauteur_projetee",
+})
+_INT_FIELDS = {"duree_travaux_mois": 1}
+
+
+def _apply_form(obj, mapping, form):
+    """Recopie les champs présents du formulaire sur un sous-objet de la DP."""
+    for key, attr in mapping:
+        if key not in form:
+            continue
+        value = form[key]
+        if key in _FLOAT_FIELDS:
+            value = float(value or 0)
+        elif key in _INT_FIELDS:
+            value = int(value or _INT_FIELDS[key])
+        setattr(obj, attr, value)
+
+
+@app.context_processor
+def _inject_dp():
+    """Expose aux templates la DP déjà chargée pendant la requête, sans re-désérialiser."""
+    dp = g.get("_dp")
+    return {"dp": dp} if dp is not None else {}
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -104,7 +262,15 @@ def _dp_to_session(dp: DeclarationPrealable):
 
 @app.route("/")
 def index():
-    return render_template("index.html")
+    # Page d'accueil statique : cache navigateur/CDN + revalidation par ETag,
+    # sauf si des messages flash sont en attente (page propre à la session)
+    has_flashes = bool(session.get("_flashes"))
+    resp = make_response(render_template("index.html"))
+    if not has_flashes:
+        resp.headers["Cache-Control"] = "public, max-age=300"
+        resp.add_etag()
+        resp.make_conditional(request)
+    return resp
 
 
 @app.route("/nouvelle-declaration")
@@ -116,70 +282,40 @@ def nouvelle_declaration():
 
 
 # ─── ÉTAPE 1 : Identité + Lieu ────────────────────────────────────
-@app.route("/etape/1", methods=["GET", "POST"])
 def etape_1():
     if "dp_data" not in session:
         return redirect(url_for("nouvelle_declaration"))
     dp = _session_to_dp()
 
     if request.method == "POST":
-        dp.demandeur.civilite = request.form.get("civilite", dp.demandeur.civilite)
-        dp.demandeur.nom = request.form.get("nom", dp.demandeur.nom)
-        dp.demandeur.prenom = request.form.get("prenom", dp.demandeur.prenom)
-        dp.demandeur.date_naissance = request.form.get("date_naissance", dp.demandeur.date_naissance)
-        dp.demandeur.lieu_naissance = request.form.get("lieu_naissance", dp.demandeur.lieu_naissance)
-        dp.demandeur.adresse = request.form.get("adresse_demandeur", dp.demandeur.adresse)
-        dp.demandeur.code_postal = request.form.get("cp_demandeur", dp.demandeur.code_postal)
-        dp.demandeur.ville = request.form.get("ville_demandeur", dp.demandeur.ville)
-        dp.demandeur.telephone = request.form.get("telephone", dp.demandeur.telephone)
-        dp.demandeur.email = request.form.get("email", dp.demandeur.email)
-        dp.demandeur.qualite = request.form.get("qualite", dp.demandeur.qualite)
-
-        dp.terrain.adresse = request.form.get("adresse_terrain", dp.terrain.adresse)
-        dp.terrain.lieu_dit = request.form.get("lieu_dit", dp.terrain.lieu_dit)
-        dp.terrain.code_postal = request.form.get("cp_terrain", dp.terrain.code_postal)
-        dp.terrain.commune = request.form.get("commune", dp.terrain.commune)
-        dp.terrain.section_cadastrale = request.form.get("section_cadastrale", dp.terrain.section_cadastrale)
-        dp.terrain.numero_parcelle = request.form.get("numero_parcelle", dp.terrain.numero_parcelle)
-        dp.terrain.superficie_terrain = float(request.form.get("superficie_terrain", dp.terrain.superficie_terrain) or 0)
-        dp.terrain.zone_plu = request.form.get("zone_plu", dp.terrain.zone_plu)
+        _apply_form(dp.demandeur, _STEP1_DEMANDEUR_FIELDS, request.form)
+        _apply_form(dp.terrain, _STEP1_TERRAIN_FIELDS, request.form)
         dp.terrain.est_lotissement = "est_lotissement" in request.form
         dp.terrain.est_zone_protegee = "est_zone_protegee" in request.form
         dp.terrain.est_monument_historique = "est_monument_historique" in request.form
 
         _dp_to_session(dp)
-        return redirect(url_for("etape", num=2))
+        return redirect(url_for("etape", num=2), code=303)
 
     return render_template("step1_identity_place.html", dp=dp, step=1, total_steps=5)
 
 
 # ─── ÉTAPE 2 : Type de travaux ────────────────────────────────────
-@app.route("/etape/2", methods=["GET", "POST"])
 def etape_2():
     if "dp_data" not in session:
         return redirect(url_for("nouvelle_declaration"))
     dp = _session_to_dp()
 
     if request.method == "POST":
-        dp.travaux.type_travaux = request.form.get("type_travaux", dp.travaux.type_travaux)
-        dp.travaux.description_courte = request.form.get("description_courte", dp.travaux.description_courte)
-        dp.travaux.surface_plancher_existante = float(request.form.get("surface_plancher_existante", dp.travaux.surface_plancher_existante) or 0)
-        dp.travaux.surface_plancher_creee = float(request.form.get("surface_plancher_creee", dp.travaux.surface_plancher_creee) or 0)
-        dp.travaux.emprise_au_sol_existante = float(request.form.get("emprise_au_sol_existante", dp.travaux.emprise_au_sol_existante) or 0)
-        dp.travaux.emprise_au_sol_creee = float(request.form.get("emprise_au_sol_creee", dp.travaux.emprise_au_sol_creee) or 0)
-        dp.travaux.hauteur_existante = float(request.form.get("hauteur_existante", dp.travaux.hauteur_existante) or 0)
-        dp.travaux.hauteur_projetee = float(request.form.get("hauteur_projetee", dp.travaux.hauteur_projetee) or 0)
-        dp.travaux.date_debut_prevue = request.form.get("date_debut_prevue", dp.travaux.date_debut_prevue)
-        dp.travaux.duree_travaux_mois = int(request.form.get("duree_travaux_mois", dp.travaux.duree_travaux_mois) or 1)
+        _apply_form(dp.travaux, _STEP2_TRAVAUX_FIELDS, request.form)
 
         _dp_to_session(dp)
-        return redirect(url_for("etape", num=3))
+        return redirect(url_for("etape", num=3), code=303)
 
     return render_template("step2_type_travaux.html", dp=dp, step=2, total_steps=5)
 
 
 # ─── ÉTAPE 3 : Photos par paires (avant/après) ────────────────────
-@app.route("/etape/3", methods=["GET", "POST"])
 def etape_3():
     if "dp_data" not in session:
         return redirect(url_for("nouvelle_declaration"))
@@ -192,35 +328,36 @@ def etape_3():
         apres_files = request.files.getlist("set_apres")
 
         count = max(len(labels), len(avant_files), len(apres_files))
+        pairs = []
 
         for i in range(count):
             label = labels[i] if i < len(labels) else f"Vue {i+1}"
-            
-            chemin_avant = ""
-            chemin_apres = ""
-
-            if i < len(avant_files):
-                f_avant = avant_files[i]
-                if f_avant and f_avant.filename and allowed_file(f_avant.filename):
-                    unique = f"{uuid.uuid4().hex[:8]}_{f_avant.filename}"
-                    chemin_avant = os.path.join(UPLOAD_FOLDER, unique)
-                    f_avant.save(chemin_avant)
-
-            if i < len(apres_files):
-                f_apres = apres_files[i]
-                if f_apres and f_apres.filename and allowed_file(f_apres.filename):
-                    unique = f"{uuid.uuid4().hex[:8]}_{f_apres.filename}"
-                    chemin_apres = os.path.join(UPLOAD_FOLDER, unique)
-                    f_apres.save(chemin_apres)
-
-            if chemin_avant or chemin_apres:
-                photo_sets.append(PhotoSet(
-                    label=label.strip() or f"Vue {i+1}",
-                    chemin_avant=chemin_avant,
-                    chemin_apres=chemin_apres,
-                    description_avant=f"{label} — État existant" if chemin_avant else "",
-                    description_apres=f"{label} — État projeté" if chemin_apres else "",
-                ))
+            f_avant = avant_files[i] if i < len(avant_files) else None
+            f_apres = apres_files[i] if i < len(apres_files) else None
+            if not (f_avant and f_avant.filename and allowed_file(f_avant.filename)):
+                f_avant = None
+            if not (f_apres and f_apres.filename and allowed_file(f_apres.filename)):
+                f_apres = None
+            if f_avant or f_apres:
+                pairs.append((i, label, f_avant, f_apres))
+
+        # Hachage + écriture indépendants par fichier : on les recouvre au lieu de les enchaîner
+        uploads = [f for _, _, f_avant, f_apres in pairs for f in (f_avant, f_apres) if f]
+        chemins = {}
+        if uploads:
+            with ThreadPoolExecutor(max_workers=min(4, len(uploads))) as ex:
+                chemins = dict(zip(map(id, uploads), ex.map(_store_upload, uploads)))
+
+        for i, label, f_avant, f_apres in pairs:
+            chemin_avant = chemins[id(f_avant)] if f_avant else ""
+            chemin_apres = chemins[id(f_apres)] if f_apres else ""
+            photo_sets.append(PhotoSet(
+                label=label.strip() or f"Vue {i+1}",
+                chemin_avant=chemin_avant,
+                chemin_apres=chemin_apres,
+                description_avant=f"{label} — État existant" if chemin_avant else "",
+                description_apres=f"{label} — État projeté" if chemin_apres else "",
+            ))
 
         if photo_sets:
             dp.photo_sets = photo_sets
@@ -228,13 +365,12 @@ def etape_3():
             dp.pieces_jointes["DP8"]["fourni"] = any(ps.chemin_apres for ps in photo_sets)
 
         _dp_to_session(dp)
-        return redirect(url_for("etape", num=4))
+        return redirect(url_for("etape", num=4), code=303)
 
     return render_template("step3_photos.html", dp=dp, step=3, total_steps=5)
 
 
 # ─── ÉTAPE 4 : Analyse IA + Revue ─────────────────────────────────
-@app.route("/etape/4", methods=["GET", "POST"])
 def etape_4():
     if "dp_data" not in session:
         return redirect(url_for("nouvelle_declaration"))
@@ -242,49 +378,35 @@ def etape_4():
 
     if request.method == "POST":
         # Save reviewed/edited AI descriptions (NoticeDescriptive)
-        for field_name in [
-            "etat_initial", "etat_projete", "justification", "insertion_paysagere", 
-            "impact_environnemental", "modifications_detaillees", "modification_volume", 
-            "modification_emprise_au_sol", "modification_surface_plancher",
-            "hauteur_estimee_existante", "hauteur_estimee_projete",
-            "coherence_architecturale", "risques_reglementaires_potentiels", "niveau_confiance_global"
-        ]:
+        for field_name in NOTICE_FIELDS:
             val = request.form.get(field_name)
             if val is not None:
                 setattr(dp.notice, field_name, val)
 
         # Save aspect extérieur
-        for field_name in [
-            "facade_materiaux_existants", "facade_materiaux_projetes",
-            "menuiseries_existantes", "menuiseries_projetees",
-            "toiture_materiaux_existants", "toiture_materiaux_projetes",
-            "couleur_facade", "couleur_menuiseries", "couleur_volets", "couleur_toiture",
-            "nombre_ouvertures_existantes", "nombre_ouvertures_projetees"
-        ]:
+        for field_name in ASPECT_FIELDS:
             val = request.form.get(field_name)
             if val is not None:
                 setattr(dp.aspect_exterieur, field_name, val)
 
         _dp_to_session(dp)
-        return redirect(url_for("etape", num=5))
-
-    default_prompt = ""
+        return redirect(url_for("etape", num=5), code=303)
+
+    photos_avant = [ps.chemin_avant for ps in dp.photo_sets if ps.chemin_avant]
+    photos_apres = [ps.chemin_apres for ps in dp.photo_sets if ps.chemin_apres]
+    projet_info = {
+        "adresse": dp.terrain.adresse,
+        "commune": dp.terrain.commune,
+        "code_postal": dp.terrain.code_postal,
+        "zone_plu": dp.terrain.zone_plu,
+        "type_travaux": dp.travaux.type_travaux,
+        "description": dp.travaux.description_courte,
+        "surface_existante": dp.travaux.surface_plancher_existante,
+    }
     try:
-        from ai_service import _build_analysis_prompt
-        photos_avant = [ps.chemin_avant for ps in dp.photo_sets if ps.chemin_avant]
-        photos_apres = [ps.chemin_apres for ps in dp.photo_sets if ps.chemin_apres]
-        projet_info = {
-            "adresse": dp.terrain.adresse,
-            "commune": dp.terrain.commune,
-            "code_postal": dp.terrain.code_postal,
-            "zone_plu": dp.terrain.zone_plu,
-            "type_travaux": dp.travaux.type_travaux,
-            "description": dp.travaux.description_courte,
-            "surface_existante": dp.travaux.surface_plancher_existante,
-        }
         default_prompt = _build_analysis_prompt(len(photos_avant), len(photos_apres), projet_info)
-    except Exception as e:
-        pass
+    except Exception:
+        default_prompt = ""
 
     return render_template("step4_ai_review.html", dp=dp, step=4, total_steps=5,
                            models=get_available_models(), default_model=get_default_model(),
@@ -292,7 +414,6 @@ def etape_4():
 
 
 # ─── ÉTAPE 5 : Récapitulatif + PDF ────────────────────────────────
-@app.route("/etape/5", methods=["GET"])
 def etape_5():
     if "dp_data" not in session:
         return redirect(url_for("nouvelle_declaration"))
@@ -301,16 +422,19 @@ def etape_5():
 
 
 # ─── Generic route dispatcher ─────────────────────────────────────
+# Une seule règle d'URL pour toutes les étapes
+_ETAPES = {
+    1: etape_1,
+    2: etape_2,
+    3: etape_3,
+    4: etape_4,
+    5: etape_5,
+}
+
+
 @app.route("/etape/<int:num>", methods=["GET", "POST"])
 def etape(num):
-    route_map = {
-        1: etape_1,
-        2: etape_2,
-        3: etape_3,
-        4: etape_4,
-        5: etape_5,
-    }
-    handler = route_map.get(num)
+    handler = _ETAPES.get(num)
     if handler:
         return handler()
     return redirect(url_for("index"))
@@ -320,88 +444,173 @@ def etape(num):
 # API ENDPOINTS
 # ═══════════════════════════════════════════════════════════════════
 
+# Analyses IA en arrière-plan : la requête rend la main tout de suite (202) et le
+# client interroge /api/analyser-photos/<job_id> jusqu'au résultat.
+# Avec Redis, l'état du job et son résultat y sont publiés (TTL) : le polling peut
+# atteindre n'importe quel worker. Sans Redis, l'état reste dans ce processus.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+ANALYSIS_JOB_TTL = 15 * 60  # secondes avant d'oublier un résultat jamais récupéré
+_ANALYSIS_KEY = "dp:analyse:{}"
+_analysis_pool = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analyse")
+_analysis_jobs = {}  # job_id -> (Future, instant de soumission), sans Redis uniquement
+_analysis_jobs_lock = threading.Lock()
+_NOTICE_FIELD_SET = frozenset(NOTICE_FIELDS)
+_ASPECT_FIELD_SET = frozenset(ASPECT_FIELDS)
+
+
+def _future_state(future) -> dict:
+    """État sérialisable d'une analyse terminée."""
+    try:
+        return {"state": "done", "result": future.result()}
+    except Exception as e:
+        log.exception("[API] Analyse échouée")
+        return {"state": "error", "error": str(e)}
+
+
+def _publish_analysis(key: str, future) -> None:
+    """Callback de fin de job : publie le résultat dans Redis pour tous les workers."""
+    _redis.set(key, orjson.dumps(_future_state(future)), ex=ANALYSIS_JOB_TTL)
+
+
+def _submit_analysis(*args, **kwargs) -> str:
+    """Soumet analyser_photos au pool et retourne l'identifiant du job."""
+    job_id = uuid.uuid4().hex
+    if _redis is not None:
+        key = _ANALYSIS_KEY.format(job_id)
+        # "pending" publié avant la soumission : le callback ne peut pas le précéder
+        _redis.set(key, orjson.dumps({"state": "pending"}), ex=ANALYSIS_JOB_TTL)
+        future = _analysis_pool.submit(analyser_photos, *args, **kwargs)
+        future.add_done_callback(partial(_publish_analysis, key))
+        return job_id
+
+    now = time.monotonic()
+    with _analysis_jobs_lock:
+        for old_id, (_, submitted) in list(_analysis_jobs.items()):
+            if now - submitted > ANALYSIS_JOB_TTL:
+                del _analysis_jobs[old_id]
+        _analysis_jobs[job_id] = (_analysis_pool.submit(analyser_photos, *args, **kwargs), now)
+    return job_id
+
+
+def _take_analysis(job_id: str):
+    """
+    État d'un job ({"state": "pending" | "done" | "error", ...}) ou None s'il est
+    inconnu ou expiré. Un job terminé est retiré : son résultat n'est appliqué qu'une fois.
+    """
+    if _redis is not None:
+        key = _ANALYSIS_KEY.format(job_id)
+        raw = _redis.get(key)
+        if raw is None:
+            return None
+        state = orjson.loads(raw)
+        if state["state"] != "pending":
+            _redis.delete(key)
+        return state
+
+    with _analysis_jobs_lock:
+        job = _analysis_jobs.get(job_id)
+        if job is None:
+            return None
+        future, _ = job
+        if not future.done():
+            return {"state": "pending"}
+        del _analysis_jobs[job_id]
+    return _future_state(future)
+
+
+def _apply_analysis(dp: DeclarationPrealable, analysis: dict) -> dict:
+    """Reporte le résultat plat de l'IA sur la DP et construit la réponse API."""
+    for f in NOTICE_FIELDS:
+        val = analysis.get(f, "")
+        if isinstance(val, str) and val.strip():
+            setattr(dp.notice, f, val.strip())
+
+    for f in ASPECT_FIELDS:
+        val = analysis.get(f, "")
+        if isinstance(val, str) and val.strip():
+            setattr(dp.aspect_exterieur, f, val.strip())
+        elif isinstance(val, list):
+            joined = ", ".join(str(v) for v in val)
+            if joined:
+                setattr(dp.aspect_exterieur, f, joined)
+
+    return {
+        "success": True,
+        "notice": {k: v for k, v in asdict(dp.notice).items() if k in _NOTICE_FIELD_SET},
+        "aspect": {k: v for k, v in asdict(dp.aspect_exterieur).items() if k in _ASPECT_FIELD_SET},
+    }
+
+
 @app.route("/api/analyser-photos", methods=["POST"])
 def api_analyser_photos():
-    """Analyse les photos via l'IA et retourne descriptions + aspect extérieur."""
+    """Lance l'analyse IA des photos en arrière-plan et retourne l'identifiant du job (202)."""
     dp = _session_to_dp()
 
-    photos_avant = [ps.chemin_avant for ps in dp.photo_sets if ps.chemin_avant and os.path.exists(ps.chemin_avant)]
-    photos_apres = [ps.chemin_apres for ps in dp.photo_sets if ps.chemin_apres and os.path.exists(ps.chemin_apres)]
+    # Un seul stat() par chemin distinct de ce dossier (le dossier d'upload est partagé)
+    chemins = {c for ps in dp.photo_sets for c in (ps.chemin_avant, ps.chemin_apres) if c}
+    presentes = {c for c in chemins if os.path.exists(c)}
+    photos_avant, photos_apres = [], []
+    for ps in dp.photo_sets:
+        if ps.chemin_avant in presentes:
+            photos_avant.append(ps.chemin_avant)
+        if ps.chemin_apres in presentes:
+            photos_apres.append(ps.chemin_apres)
 
-    print(f"\n{'='*60}")
-    print(f"[API] {len(photos_avant)} avant + {len(photos_apres)} apres photos")
+    log.info("[API] %d avant + %d apres photos", len(photos_avant), len(photos_apres))
 
     if not photos_avant and not photos_apres:
         return jsonify({"error": "Aucune photo trouvée. Retournez à l'étape précédente pour en ajouter."}), 400
 
-    try:
-        # Pass project context from previous steps
-        projet_info = {
-            "adresse": dp.terrain.adresse,
-            "commune": dp.terrain.commune,
-            "code_postal": dp.terrain.code_postal,
-            "zone_plu": dp.terrain.zone_plu,
-            "type_travaux": dp.travaux.type_travaux,
-            "description": dp.travaux.description_courte,
-            "surface_existante": dp.travaux.surface_plancher_existante,
-            "hauteur": dp.travaux.hauteur_existante,
-        }
-
-        # Get model selection from request
-        req_data = request.get_json(silent=True) or {}
-        model_key = req_data.get("model", get_default_model())
-        print(f"[API] Using model: {model_key}")
-
-        # Single AI call with model selection
-        analysis = analyser_photos(photos_avant, photos_apres, projet_info=projet_info, model_key=model_key)
-
-        # Map ALL fields from the flat analysis result
-        notice_fields = [
-            "etat_initial", "etat_projete", "justification", "insertion_paysagere", 
-            "impact_environnemental", "modifications_detaillees", "modification_volume", 
-            "modification_emprise_au_sol", "modification_surface_plancher",
-            "hauteur_estimee_existante", "hauteur_estimee_projete",
-            "coherence_architecturale", "risques_reglementaires_potentiels", "niveau_confiance_global"
-        ]
-        aspect_fields = [
-            "facade_materiaux_existants", "facade_materiaux_projetes",
-            "menuiseries_existantes", "menuiseries_projetees",
-            "toiture_materiaux_existants", "toiture_materiaux_projetes",
-            "couleur_facade", "couleur_menuiseries", "couleur_volets", "couleur_toiture",
-            "nombre_ouvertures_existantes", "nombre_ouvertures_projetees"
-        ]
-
-        for f in notice_fields:
-            val = analysis.get(f, "")
-            if isinstance(val, str) and val.strip():
-                setattr(dp.notice, f, val.strip())
-
-        for f in aspect_fields:
-            val = analysis.get(f, "")
-            if isinstance(val, str) and val.strip():
-                setattr(dp.aspect_exterieur, f, val.strip())
-            elif isinstance(val, list):
-                joined = ", ".join(str(v) for v in val)
-                if joined:
-                    setattr(dp.aspect_exterieur, f, joined)
+    # Pass project context from previous steps
+    projet_info = {
+        "adresse": dp.terrain.adresse,
+        "commune": dp.terrain.commune,
+        "code_postal": dp.terrain.code_postal,
+        "zone_plu": dp.terrain.zone_plu,
+        "type_travaux": dp.travaux.type_travaux,
+        "description": dp.travaux.description_courte,
+        "surface_existante": dp.travaux.surface_plancher_existante,
+        "hauteur": dp.travaux.hauteur_existante,
+    }
 
-        _dp_to_session(dp)
+    # Get model selection from request
+    req_data = request.get_json(silent=True) or {}
+    model_key = req_data.get("model", get_default_model())
+    log.info("[API] Using model: %s", model_key)
+
+    job_id = _submit_analysis(photos_avant, photos_apres, projet_info=projet_info, model_key=model_key)
+    session["analysis_job"] = job_id
+    return jsonify({"job_id": job_id}), 202
+
+
+@app.route("/api/analyser-photos/<job_id>")
+def api_analyser_photos_resultat(job_id):
+    """Retourne l'état d'une analyse ; une fois terminée, l'applique à la DP de la session."""
+    if session.get("analysis_job") != job_id:
+        return jsonify({"error": "Analyse inconnue."}), 404
+
+    state = _take_analysis(job_id)
+    if state is None:
+        return jsonify({"error": "Analyse inconnue ou expirée."}), 404
+    if state["state"] == "pending":
+        return jsonify({"state": "pending"}), 202
+
+    session.pop("analysis_job", None)
+    if state["state"] == "error":
+        return jsonify({"error": state["error"]}), 500
 
-        response_data = {
-            "success": True,
-            "notice": {f: getattr(dp.notice, f) for f in notice_fields},
-            "aspect": {f: getattr(dp.aspect_exterieur, f) for f in aspect_fields},
-        }
+    try:
+        dp = _session_to_dp()
+        response_data = _apply_analysis(dp, state["result"])
+        _dp_to_session(dp)
 
         filled = sum(1 for v in response_data["notice"].values() if v) + sum(1 for v in response_data["aspect"].values() if v)
-        print(f"[API] {filled}/15 fields populated")
-        print(f"{'='*60}\n")
+        log.info("[API] %d/15 fields populated", filled)
 
         return jsonify(response_data)
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log.exception("[API] Analyse échouée")
         return jsonify({"error": str(e)}), 500
 
 
@@ -418,32 +627,18 @@ def telecharger_pdf():
         # Get selected theme from query params
         theme = request.args.get("theme", "classique")
         
-        # Generate PDF to a temp file with a clean ASCII name
+        # Clean ASCII download name
         clean_nom = "".join(c for c in dp.demandeur.nom if c.isalnum() or c == "_")
         clean_prenom = "".join(c for c in dp.demandeur.prenom if c.isalnum() or c == "_")
         download_name = f"Declaration_Prealable_{clean_nom}_{clean_prenom}.pdf"
 
-        # Write to a temp file
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-        tmp_path = tmp.name
-        tmp.close()
-
-        generer_pdf(dp, output_path=tmp_path, theme_name=theme)
-
-        # Read bytes and clean up
-        with open(tmp_path, "rb") as f:
-            pdf_bytes = f.read()
-
-        try:
-            os.unlink(tmp_path)
-        except OSError:
-            pass
+        # PDF construit en mémoire : ni fichier temporaire ni relecture
+        buf = io.BytesIO()
+        generer_pdf(dp, output_path=buf, theme_name=theme)
+        buf.seek(0)
 
-        response = make_response(pdf_bytes)
-        response.headers["Content-Type"] = "application/pdf"
-        response.headers["Content-Disposition"] = f'attachment; filename="{download_name}"'
-        response.headers["Content-Length"] = len(pdf_bytes)
-        return response
+        return send_file(buf, mimetype="application/pdf", as_attachment=True,
+                         download_name=download_name, max_age=0)
 
     except Exception as e:
         import traceback
@@ -3,12 +3,12 @@ Modèles de données pour la Déclaration Préalable de Travaux.
 Basé sur le formulaire CERFA n°13703*09.
 """
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from typing import Optional, List
 from datetime import date
 
 
-@dataclass
+@dataclass(slots=True)
 class Demandeur:
     """Identité du demandeur (Section 1 du CERFA)."""
     civilite: str = "M."
@@ -24,7 +24,7 @@ class Demandeur:
     qualite: str = "Propriétaire"
 
 
-@dataclass
+@dataclass(slots=True)
 class Terrain:
     """Localisation et caractéristiques du terrain (Section 2 du CERFA)."""
     adresse: str = "25 Chemin des Vignes"
@@ -40,7 +40,7 @@ class Terrain:
     est_monument_historique: bool = False
 
 
-@dataclass
+@dataclass(slots=True)
 class TravauxDetail:
     """Détail des travaux envisagés (Section 3 du CERFA)."""
     type_travaux: str = "Modification de l'aspect extérieur"
@@ -55,7 +55,7 @@ class TravauxDetail:
     duree_travaux_mois: int = 3
 
 
-@dataclass
+@dataclass(slots=True)
 class AspectExterieur:
     """Aspect extérieur des constructions (Section 4 du CERFA). Rempli par l'IA."""
     facade_materiaux_existants: str = ""
@@ -76,7 +76,7 @@ class AspectExterieur:
     nombre_ouvertures_projetees: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class PhotoSet:
     """
     Paire de photos avant/après pour un même emplacement.
@@ -89,7 +89,7 @@ class PhotoSet:
     description_apres: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class NoticeDescriptive:
     """Notice descriptive du projet (pièce obligatoire). Rempli par l'IA."""
     etat_initial: str = ""
@@ -145,6 +145,15 @@ class DeclarationPrealable:
             self.date_creation = date.today().strftime("%d/%m/%Y")
 
 
+# Champs remplis par l'analyse IA et relus à l'étape 4, dérivés des dataclasses
+# pour ne pas diverger du modèle (les clôtures ne sont pas analysées par l'IA)
+NOTICE_FIELDS = tuple(f.name for f in fields(NoticeDescriptive))
+ASPECT_FIELDS = tuple(
+    f.name for f in fields(AspectExterieur)
+    if f.name not in ("cloture_existante", "cloture_projetee")
+)
+
+
 def get_dummy_declaration() -> DeclarationPrealable:
     """Retourne une déclaration pré-remplie avec des données fictives."""
     dp = DeclarationPrealable()
@@ -5,8 +5,15 @@ exigences administratives françaises.
 Photos présentées en comparaison avant/après côte à côte.
 """
 
+import copy
+import io
 import os
+import hashlib
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date
+from functools import lru_cache, partial
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm, cm
@@ -18,12 +25,25 @@ from reportlab.platypus import (
 )
 from reportlab.pdfgen import canvas
 from reportlab.lib.colors import HexColor
-from PIL import Image as PILImage
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
 
 from models import DeclarationPrealable, PhotoSet
 
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # ─── Configuration des thèmes ────────────────────────────────────────
+_THEME_NAMES = ("classique", "moderne", "nature", "architecte")
+
+
+def _theme_key(theme_name: str) -> str:
+    """Nom de thème canonique : un nom inconnu (venu de la requête) retombe sur "classique"."""
+    return theme_name if theme_name in _THEME_NAMES else "classique"
+
+
+# Thèmes et feuilles de styles construits une fois par thème puis partagés entre
+# les PDF (lecture seule) ; cache borné car le nom vient de la requête
+@lru_cache(maxsize=8)
 def _get_theme_config(theme_name: str = "classique") -> dict:
     themes = {
         "classique": {
@@ -75,8 +95,12 @@ def _get_theme_config(theme_name: str = "classique") -> dict:
 
 
 # ─── Styles personnalisés dynamiques ───────────────────────────────
-def _get_styles(theme: dict):
+@lru_cache(maxsize=8)
+def _get_styles(theme_name: str = "classique"):
+    theme = _get_theme_config(theme_name)
     styles = getSampleStyleSheet()
+    styles.theme = theme  # les helpers lisent les couleurs du thème depuis la feuille de styles
+    styles.theme_name = _theme_key(theme_name)  # clé des caches de flowables
     
     styles.add(ParagraphStyle(
         name='TitreDocument',
@@ -175,6 +199,52 @@ def _get_styles(theme: dict):
         spaceAfter=2 * mm,
     ))
     
+    # Page de garde
+    styles.add(ParagraphStyle(
+        name='Republique',
+        fontName='Helvetica-Bold',
+        fontSize=11,
+        textColor=theme["primary"],
+        alignment=TA_CENTER,
+        spaceAfter=2 * mm,
+    ))
+    
+    styles.add(ParagraphStyle(
+        name='Devise',
+        fontName='Helvetica-Oblique',
+        fontSize=9,
+        textColor=theme["text_body"],
+        alignment=TA_CENTER,
+        spaceAfter=15 * mm,
+    ))
+    
+    # Bloc signature
+    styles.add(ParagraphStyle(
+        name='Signature',
+        fontName='Helvetica',
+        fontSize=10,
+        textColor=theme["text_title"],
+        alignment=TA_LEFT,
+        spaceAfter=15 * mm,
+    ))
+    
+    styles.add(ParagraphStyle(
+        name='SignatureNom',
+        fontName='Helvetica-Bold',
+        fontSize=10,
+        textColor=theme["text_title"],
+        alignment=TA_LEFT,
+        spaceAfter=3 * mm,
+    ))
+    
+    styles.add(ParagraphStyle(
+        name='SignatureLabel',
+        fontName='Helvetica',
+        fontSize=9,
+        textColor=theme["text_body"],
+        alignment=TA_LEFT,
+    ))
+    
     return styles
 
 
@@ -183,33 +253,43 @@ class _PDFTemplate:
     def __init__(self, dp: DeclarationPrealable, theme: dict):
         self.dp = dp
         self.theme = theme
+        # Géométrie de page constante : calculée une fois, pas à chaque page
+        self._w, self._h = A4
+        self._band_h = 3 * mm
+        self._band_y = self._h - self._band_h
+        self._third = self._w / 3
+        self._two_thirds = 2 * self._w / 3
+        self._right_x = self._w - 15 * mm
+        self._y_ref = self._h - 12 * mm
+        self._center_x = self._w / 2
+        self._footer_y = 10 * mm
+        self._line_x0 = 15 * mm
+        self._line_y = 15 * mm
     
     def header_footer(self, canvas_obj, doc):
         canvas_obj.saveState()
-        width, height = A4
         
-        band_height = 3 * mm
         if self.theme["bandeau_style"] == "tricolore":
             canvas_obj.setFillColor(self.theme["primary"])
-            canvas_obj.rect(0, height - band_height, width / 3, band_height, fill=True, stroke=0)
+            canvas_obj.rect(0, self._band_y, self._third, self._band_h, fill=True, stroke=0)
             canvas_obj.setFillColor(colors.white)
-            canvas_obj.rect(width / 3, height - band_height, width / 3, band_height, fill=True, stroke=0)
+            canvas_obj.rect(self._third, self._band_y, self._third, self._band_h, fill=True, stroke=0)
             canvas_obj.setFillColor(self.theme["secondary"])
-            canvas_obj.rect(2 * width / 3, height - band_height, width / 3, band_height, fill=True, stroke=0)
+            canvas_obj.rect(self._two_thirds, self._band_y, self._third, self._band_h, fill=True, stroke=0)
         else:
             canvas_obj.setFillColor(self.theme["primary"])
-            canvas_obj.rect(0, height - band_height, width, band_height, fill=True, stroke=0)
+            canvas_obj.rect(0, self._band_y, self._w, self._band_h, fill=True, stroke=0)
         
         # Référence
         canvas_obj.setFont("Helvetica", 7)
         canvas_obj.setFillColor(self.theme["text_body"])
-        canvas_obj.drawRightString(width - 15 * mm, height - 12 * mm, f"Ref. {self.dp.reference}")
+        canvas_obj.drawRightString(self._right_x, self._y_ref, f"Ref. {self.dp.reference}")
         
         # Pied de page
         canvas_obj.setFont("Helvetica", 7)
         canvas_obj.setFillColor(self.theme["border"])
         canvas_obj.drawCentredString(
-            width / 2, 10 * mm,
+            self._center_x, self._footer_y,
             f"Declaration Prealable - {self.dp.demandeur.nom} {self.dp.demandeur.prenom} - "
             f"Generee le {self.dp.date_creation} - Page {doc.page}"
         )
@@ -217,73 +297,421 @@ class _PDFTemplate:
         # Ligne fine
         canvas_obj.setStrokeColor(self.theme["primary"])
         canvas_obj.setLineWidth(0.5)
-        canvas_obj.line(15 * mm, 15 * mm, width - 15 * mm, 15 * mm)
+        canvas_obj.line(self._line_x0, self._line_y, self._right_x, self._line_y)
         
         canvas_obj.restoreState()
 
 
 # ─── Helpers ───────────────────────────────────────────────────────
-def _section_header(title: str, styles, theme: dict) -> list:
-    return [
-        HRFlowable(width="100%", thickness=1, color=theme["primary"], spaceAfter=2 * mm),
-        Paragraph(title, styles['SectionTitre']),
-    ]
+_SECTION_HEADER_CACHE: dict[tuple[str, str], list] = {}
+
+
+def _section_header(title: str, styles) -> list:
+    """Filet + titre de section, construits une fois par (thème, titre) puis copiés."""
+    key = (styles.theme_name, title)
+    cached = _SECTION_HEADER_CACHE.get(key)
+    if cached is None:
+        cached = _SECTION_HEADER_CACHE[key] = [
+            HRFlowable(width="100%", thickness=1, color=styles.theme["primary"], spaceAfter=2 * mm),
+            Paragraph(title, styles['SectionTitre']),
+        ]
+    # Copies superficielles : la mise en page écrit width/height sur l'instance
+    return [copy.copy(f) for f in cached]
+
 
+@lru_cache(maxsize=32)
+def _pieces_data(theme_name: str, rows: tuple) -> tuple:
+    """Lignes et TableStyle de l'index des pièces, mémorisés par (thème, contenu)."""
+    theme = _get_theme_config(theme_name)
+    data = (("Ref.", "Designation", "Statut"),) + tuple(
+        (ref, nom, "Fourni" if fourni else "Non fourni") for ref, nom, fourni in rows
+    )
+    style = TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('BACKGROUND', (0, 0), (-1, 0), theme["primary"]),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('TEXTCOLOR', (0, 1), (-1, -1), theme["text_title"]),
+        ('LINEBELOW', (0, 0), (-1, -1), 0.3, theme["border"]),
+        ('TOPPADDING', (0, 0), (-1, -1), 4),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+        ('LEFTPADDING', (0, 0), (-1, -1), 4),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, theme["bg_light"]]),
+    ])
+    return data, style
+
+
+def _pieces_table(pieces_jointes: dict, styles) -> Table:
+    """
+    Index des pièces jointes. Les lignes et le TableStyle viennent d'un cache
+    borné (la liste des pièces varie peu d'un dossier à l'autre) ; une Table
+    neuve est construite à chaque appel (la mise en page la modifie).
+    """
+    rows = tuple((ref, info["nom"], bool(info["fourni"])) for ref, info in pieces_jointes.items())
+    data, style = _pieces_data(styles.theme_name, rows)
+    t = Table([list(r) for r in data], colWidths=[18 * mm, 120 * mm, 32 * mm], hAlign='LEFT')
+    t.setStyle(style)
+    return t
+
+
+@lru_cache(maxsize=32)
+def _signature_block(theme_name: str, commune: str, date_creation: str,
+                     civilite: str, prenom: str, nom: str) -> tuple:
+    """Bloc de signature (filet + mentions), mémorisé ; l'appelant en ajoute des copies."""
+    styles = _get_styles(theme_name)
+    return (
+        HRFlowable(width="100%", thickness=0.5, color=styles.theme["border"], spaceAfter=5 * mm),
+        Paragraph(f"Fait a {commune}, le {date_creation}", styles['Signature']),
+        Paragraph(f"Le demandeur : {civilite} {prenom} {nom}", styles['SignatureNom']),
+        Paragraph("Signature :", styles['SignatureLabel']),
+    )
+
+
+_FIELD_COL_WIDTHS = (55 * mm, 115 * mm)
+_CELL_PADDING = 12  # LEFTPADDING + RIGHTPADDING par défaut d'une cellule de Table
 
-def _field_row(label: str, value: str, styles, theme: dict) -> Table:
+
+def _cell(text: str, style, width: float):
+    """Texte brut si la valeur tient sur une ligne (pas de parsing Paragraph), sinon Paragraph."""
+    if "\n" not in text and stringWidth(text, style.fontName, style.fontSize) <= width - _CELL_PADDING:
+        return text
+    return Paragraph(text, style)
+
+
+def _field_rows(pairs: list, styles) -> Table:
+    """Une seule Table libellé/valeur par groupe de champs (au lieu d'une Table par ligne)."""
+    champ, valeur = styles['Champ'], styles['Valeur']
+    label_w, value_w = _FIELD_COL_WIDTHS
     t = Table(
-        [[Paragraph(label, styles['Champ']), Paragraph(str(value), styles['Valeur'])]],
-        colWidths=[55 * mm, 115 * mm],
+        [[_cell(label, champ, label_w), _cell(str(value), valeur, value_w)] for label, value in pairs],
+        colWidths=list(_FIELD_COL_WIDTHS),
         hAlign='LEFT'
     )
     t.setStyle(TableStyle([
         ('VALIGN', (0, 0), (-1, -1), 'TOP'),
         ('TOPPADDING', (0, 0), (-1, -1), 1),
         ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
-        ('LINEBELOW', (0, 0), (-1, -1), 0.3, theme["border"]),
+        ('LINEBELOW', (0, 0), (-1, -1), 0.3, styles.theme["border"]),
+        # Police des cellules en texte brut, calquée sur les styles Champ / Valeur
+        ('FONTNAME', (0, 0), (0, -1), champ.fontName),
+        ('FONTSIZE', (0, 0), (0, -1), champ.fontSize),
+        ('LEADING', (0, 0), (0, -1), champ.leading),
+        ('TEXTCOLOR', (0, 0), (0, -1), champ.textColor),
+        ('FONTNAME', (1, 0), (1, -1), valeur.fontName),
+        ('FONTSIZE', (1, 0), (1, -1), valeur.fontSize),
+        ('LEADING', (1, 0), (1, -1), valeur.leading),
+        ('TEXTCOLOR', (1, 0), (1, -1), valeur.textColor),
     ]))
     return t
 
 
-def _fit_image(path: str, max_width: float, max_height: float):
+@lru_cache(maxsize=32)
+def _image_reader_cached(path: str, mtime_ns: int, size: int) -> ImageReader:
+    """ImageReader mémorisé ; mtime/taille dans la clé invalident un fichier réécrit sur place."""
+    return ImageReader(path)
+
+
+# Marqueurs SOFn portant les dimensions (C4 = DHT, C8 = JPG, CC = DAC n'en sont pas)
+_JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _jpeg_size(f):
+    """Dimensions (w, h) lues dans le segment SOF d'un JPEG, sans décoder l'image."""
+    f.seek(2)
+    while True:
+        b = f.read(1)
+        while b and b != b"\xff":
+            b = f.read(1)
+        while b == b"\xff":  # octets de remplissage
+            b = f.read(1)
+        if not b:
+            return None
+        marker = b[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:  # marqueurs sans longueur
+            continue
+        if marker in _JPEG_SOF:
+            seg = f.read(7)
+            if len(seg) < 7:
+                return None
+            return int.from_bytes(seg[5:7], "big"), int.from_bytes(seg[3:5], "big")
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        f.seek(int.from_bytes(length, "big") - 2, 1)
+
+
+@lru_cache(maxsize=32)
+def _image_size_cached(path: str, mtime_ns: int, file_size: int) -> tuple:
+    """
+    Dimensions d'une image en pixels : lecture de l'en-tête pour JPEG (SOF) et
+    PNG (IHDR), ImageReader uniquement pour les autres formats. mtime/taille
+    dans la clé invalident un fichier réécrit sur place.
+    """
+    with open(path, "rb") as f:
+        head = f.read(24)
+        size = None
+        if head[:2] == b"\xff\xd8":
+            size = _jpeg_size(f)
+        elif head[:8] == _PNG_SIGNATURE and head[12:16] == b"IHDR":
+            size = int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+    if size and size[0] and size[1]:
+        return size
+    return _image_reader_cached(path, mtime_ns, file_size).getSize()
+
+
+def _image_size(path: str) -> tuple:
+    st = os.stat(path)
+    return _image_size_cached(path, st.st_mtime_ns, st.st_size)
+
+
+def _fit_image(path: str, max_width: float, max_height: float, styles):
     """Redimensionne une image pour s'adapter aux dimensions maximales."""
     try:
-        pil_img = PILImage.open(path)
-        img_w, img_h = pil_img.size
+        img_w, img_h = _image_size(path)
         ratio = min(max_width / img_w, max_height / img_h)
-        return Image(path, width=img_w * ratio, height=img_h * ratio)
+        # lazy=2 : fichier ouvert au dessin seulement, puis relâché (pas de décodage gardé en vie)
+        return Image(path, width=img_w * ratio, height=img_h * ratio, lazy=2)
+    except Exception:
+        return Paragraph(f"[Image non trouvee : {os.path.basename(path)}]", styles['Champ'])
+
+
+# Cache des photos réduites : répertoire propre à l'application (pas le /tmp partagé,
+# où un autre utilisateur pourrait déposer un fichier au nom prévisible), accès
+# réservé au propriétaire, entrées inutilisées depuis PHOTO_CACHE_MAX_AGE supprimées
+PHOTO_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(_BASE_DIR, ".pdf_cache"))
+PHOTO_CACHE_MAX_AGE = int(os.getenv("PDF_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+_PRUNE_INTERVAL = 3600  # secondes entre deux purges du cache par processus
+_last_prune = float("-inf")  # première écriture : purge immédiate
+
+
+def _prune_photo_cache():
+    """Supprime les photos du cache non utilisées depuis PHOTO_CACHE_MAX_AGE (au plus une fois par heure)."""
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < _PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    cutoff = time.time() - PHOTO_CACHE_MAX_AGE
+    try:
+        with os.scandir(PHOTO_CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+    except OSError:
+        pass
+
+
+def _prepare_photo(path: str, max_w_mm: float, max_h_mm: float, dpi: int = 150,
+                   quality: int = 78) -> str:
+    """
+    Réduit une photo aux pixels réellement affichés (à `dpi`) et la met en cache
+    sur disque en JPEG optimisé ; le PDF embarque cette copie au lieu de l'original.
+    Retourne le chemin d'origine pour un JPEG déjà assez petit, ou si l'image
+    ne peut pas être lue par PIL. PIL est importé à la demande : un module chargé
+    sans photo à préparer n'en paie pas l'import, et sans PIL les photos sont
+    embarquées telles quelles.
+    """
+    tw = round(max_w_mm / 25.4 * dpi)
+    th = round(max_h_mm / 25.4 * dpi)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path
+    key = hashlib.blake2b(f"{path}:{st.st_mtime_ns}:{st.st_size}:{tw}x{th}:q{quality}".encode(), digest_size=16)
+    cached = os.path.join(PHOTO_CACHE_DIR, f"{key.hexdigest()}.jpg")
+    try:
+        os.utime(cached)  # entrée utilisée : repousse son expiration
+        return cached
+    except OSError:
+        pass
+
+    try:
+        from PIL import Image as PILImage
+    except ImportError:
+        return path
+    tmp = None
+    try:
+        with PILImage.open(path) as img:
+            if img.format == "JPEG" and img.width <= tw and img.height <= th:
+                return path
+            img.thumbnail((tw, th), PILImage.LANCZOS)
+            os.makedirs(PHOTO_CACHE_DIR, mode=0o700, exist_ok=True)
+            # Fichier temporaire unique par appel : plusieurs threads peuvent préparer la même photo
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=PHOTO_CACHE_DIR)
+            with os.fdopen(fd, "wb") as f:
+                img.convert("RGB").save(f, "JPEG", quality=quality, optimize=True,
+                                        progressive=False, subsampling=2)
+        os.replace(tmp, cached)
     except Exception:
-        return Paragraph(f"[Image non trouvee : {os.path.basename(path)}]", _get_styles()['Champ'])
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        return path
+    _prune_photo_cache()
+    return cached
+
+
+def _dir_entries(directory: str, listings: dict) -> frozenset:
+    """
+    Noms présents dans un répertoire : un scandir par dossier au lieu d'un stat
+    par photo. `listings` vit le temps d'un generer_pdf, pour qu'un fichier
+    ajouté ensuite soit vu par le PDF suivant.
+    """
+    names = listings.get(directory)
+    if names is None:
+        try:
+            with os.scandir(directory) as entries:
+                names = frozenset(e.name for e in entries)
+        except OSError:
+            names = frozenset()
+        listings[directory] = names
+    return names
 
 
-def _resolve_photo_path(chemin):
+def _resolve_photo_path(chemin, listings: dict):
     """Resolve photo path — handles both absolute and relative paths."""
     if not chemin:
         return None
-    if os.path.isabs(chemin) and os.path.exists(chemin):
-        return chemin
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    rel_path = os.path.join(base_dir, chemin)
-    if os.path.exists(rel_path):
-        return rel_path
+    if os.path.isabs(chemin):
+        return chemin if os.path.exists(chemin) else None
+    rel_dir, name = os.path.split(os.path.join(_BASE_DIR, chemin))
+    if name in _dir_entries(rel_dir, listings):
+        return os.path.join(rel_dir, name)
     return None
 
 
+# ─── Tables de champs déclaratives ─────────────────────────────────
+# (libellé, getter[, condition]) : une ligne par champ, la condition filtre les champs facultatifs
+def _attr(name: str, fmt: str = "{}", empty: str = None):
+    """Getter formatant l'attribut `name` (remplacé par `empty` s'il est vide)."""
+    def get(obj):
+        value = getattr(obj, name)
+        if empty is not None and not value:
+            return empty
+        return fmt.format(value)
+    return get
+
+
+def _situations(ter) -> str:
+    situations = []
+    if ter.est_lotissement:
+        situations.append("Terrain situe dans un lotissement")
+    if ter.est_zone_protegee:
+        situations.append("Zone protegee")
+    if ter.est_monument_historique:
+        situations.append("Perimetre de monument historique")
+    return " - ".join(situations) or "Aucune situation particuliere"
+
+
+_DEMANDEUR_FIELDS = (
+    ("Civilite :", _attr("civilite")),
+    ("Nom :", _attr("nom")),
+    ("Prenom :", _attr("prenom")),
+    ("Date de naissance :", _attr("date_naissance")),
+    ("Lieu de naissance :", _attr("lieu_naissance")),
+    ("Adresse :", lambda dem: f"{dem.adresse}, {dem.code_postal} {dem.ville}"),
+    ("Telephone :", _attr("telephone")),
+    ("Email :", _attr("email")),
+    ("Qualite :", _attr("qualite")),
+)
+
+_TERRAIN_FIELDS = (
+    ("Adresse du terrain :", lambda ter: f"{ter.adresse}, {ter.code_postal} {ter.commune}"),
+    ("Lieu-dit :", _attr("lieu_dit"), lambda ter: ter.lieu_dit),
+    ("References cadastrales :", lambda ter: f"Section {ter.section_cadastrale}, Parcelle n {ter.numero_parcelle}"),
+    ("Superficie :", _attr("superficie_terrain", "{} m2")),
+    ("Zone PLU :", _attr("zone_plu")),
+    ("Situation particuliere :", _situations),
+)
+
+_TRAVAUX_FIELDS = (
+    ("Type de travaux :", _attr("type_travaux")),
+    ("Description :", _attr("description_courte")),
+    ("Surface plancher existante :", _attr("surface_plancher_existante", "{} m2")),
+    ("Surface plancher creee :", _attr("surface_plancher_creee", "{} m2")),
+    ("Emprise au sol existante :", _attr("emprise_au_sol_existante", "{} m2")),
+    ("Emprise au sol creee :", _attr("emprise_au_sol_creee", "{} m2")),
+    ("Hauteur existante :", _attr("hauteur_existante", "{} m")),
+    ("Hauteur projetee :", _attr("hauteur_projetee", "{} m")),
+    ("Date debut prevue :", _attr("date_debut_prevue")),
+    ("Duree estimee :", _attr("duree_travaux_mois", "{} mois")),
+)
+
+# Section 4 : (sous-titre, champs) de l'aspect extérieur
+_ASPECT_GROUPS = (
+    ("Ouvertures et Menuiseries", (
+        ("Nombre existant :", _attr("nombre_ouvertures_existantes", empty="—")),
+        ("Nombre projete :", _attr("nombre_ouvertures_projetees", empty="—")),
+        ("Types existants :", _attr("menuiseries_existantes", empty="—")),
+        ("Types projetes :", _attr("menuiseries_projetees", empty="—")),
+    )),
+    ("Facades", (
+        ("Materiaux existants :", _attr("facade_materiaux_existants", empty="—")),
+        ("Materiaux projetes :", _attr("facade_materiaux_projetes", empty="—")),
+    )),
+    ("Toiture", (
+        ("Materiaux existants :", _attr("toiture_materiaux_existants", empty="—")),
+        ("Materiaux projetes :", _attr("toiture_materiaux_projetes", empty="—")),
+    )),
+    ("Cloture", (
+        ("Existante :", _attr("cloture_existante", empty="—")),
+        ("Projetee :", _attr("cloture_projetee", empty="—")),
+    )),
+)
+
+_NOTICE_TECH_FIELDS = (
+    ("Surface plancher :", _attr("modification_surface_plancher", empty="—")),
+    ("Emprise au sol :", _attr("modification_emprise_au_sol", empty="—")),
+    ("Volume :", _attr("modification_volume", empty="—")),
+    ("Hauteur existante :", _attr("hauteur_estimee_existante", empty="—")),
+    ("Hauteur projetee :", _attr("hauteur_estimee_projete", empty="—")),
+)
+
+
+def _spec_rows(obj, specs) -> list:
+    """Évalue une table de champs sur `obj` → [(libellé, valeur)]."""
+    return [(label, get(obj)) for label, get, *when in specs if not when or when[0](obj)]
+
+
 # ─── Génération du PDF ─────────────────────────────────────────────
-def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: str = "output", theme_name: str = "classique"):
+_WRITE_CHUNK = 1 << 20
+
+
+def _write_file(path: str, data) -> None:
+    """Écrit le PDF par blocs de 1 Mo via os.write, sans copie ni tampon intermédiaire."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        with memoryview(data) as view:
+            pos, size = 0, len(view)
+            while pos < size:
+                pos += os.write(fd, view[pos:pos + _WRITE_CHUNK])
+    finally:
+        os.close(fd)
+
+
+def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: str = "output", theme_name: str = "classique",
+                quality: int = 78, max_dpi: int = 150):
     """
     Génère le dossier PDF complet de Déclaration Préalable.
     
     Args:
         dp: L'objet DeclarationPrealable rempli
-        output_path: Chemin direct vers le fichier de sortie (prioritaire)
+        output_path: Chemin direct vers le fichier de sortie, ou objet fichier
+            (ex. io.BytesIO) dans lequel écrire le PDF (prioritaire)
         output_dir: Répertoire de sortie (utilisé si output_path non fourni)
         theme_name: Le nom du thème visuel à utiliser (classique, moderne, nature, architecte)
+        quality: Qualité JPEG des photos ré-encodées (1-95)
+        max_dpi: Résolution maximale des photos à leur taille d'affichage
         
     Returns:
-        Chemin vers le fichier PDF généré
+        Chemin vers le fichier PDF généré (ou l'objet fichier fourni)
     """
-    if output_path:
+    if hasattr(output_path, "write"):
+        filepath = output_path
+    elif output_path:
         filepath = output_path
         os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
     else:
@@ -291,12 +719,18 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
         filename = f"DP_{dp.demandeur.nom}_{dp.demandeur.prenom}_{dp.reference}.pdf"
         filepath = os.path.join(output_dir, filename)
     
+    theme_name = _theme_key(theme_name)
     theme = _get_theme_config(theme_name)
-    styles = _get_styles(theme)
+    styles = _get_styles(theme_name)
     template = _PDFTemplate(dp, theme)
     
+    # Construction en mémoire puis une seule écriture disque (au lieu de
+    # nombreux petits write() pendant le build) ; un objet fichier reçoit le PDF directement
+    to_file = not hasattr(filepath, "write")
+    buf = io.BytesIO() if to_file else filepath
+
     doc = SimpleDocTemplate(
-        filepath,
+        buf,
         pagesize=A4,
         topMargin=18 * mm,
         bottomMargin=22 * mm,
@@ -313,14 +747,8 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     # ═════════════════════════════════════════════════════════════
     elements.append(Spacer(1, 30 * mm))
     
-    elements.append(Paragraph("REPUBLIQUE FRANCAISE", ParagraphStyle(
-        'Republique', fontName='Helvetica-Bold', fontSize=11,
-        textColor=theme["primary"], alignment=TA_CENTER, spaceAfter=2 * mm
-    )))
-    elements.append(Paragraph("Liberte - Egalite - Fraternite", ParagraphStyle(
-        'Devise', fontName='Helvetica-Oblique', fontSize=9,
-        textColor=theme["text_body"], alignment=TA_CENTER, spaceAfter=15 * mm
-    )))
+    elements.append(Paragraph("REPUBLIQUE FRANCAISE", styles['Republique']))
+    elements.append(Paragraph("Liberte - Egalite - Fraternite", styles['Devise']))
     
     elements.append(HRFlowable(width="40%", thickness=2, color=theme["primary"], spaceAfter=10 * mm))
     
@@ -363,16 +791,7 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     # ═════════════════════════════════════════════════════════════
     elements.extend(_section_header("1 - IDENTITE DU DEMANDEUR", styles))
     
-    dem = dp.demandeur
-    elements.append(_field_row("Civilite :", dem.civilite, styles))
-    elements.append(_field_row("Nom :", dem.nom, styles))
-    elements.append(_field_row("Prenom :", dem.prenom, styles))
-    elements.append(_field_row("Date de naissance :", dem.date_naissance, styles))
-    elements.append(_field_row("Lieu de naissance :", dem.lieu_naissance, styles))
-    elements.append(_field_row("Adresse :", f"{dem.adresse}, {dem.code_postal} {dem.ville}", styles))
-    elements.append(_field_row("Telephone :", dem.telephone, styles))
-    elements.append(_field_row("Email :", dem.email, styles))
-    elements.append(_field_row("Qualite :", dem.qualite, styles))
+    elements.append(_field_rows(_spec_rows(dp.demandeur, _DEMANDEUR_FIELDS), styles))
     
     elements.append(Spacer(1, 5 * mm))
     
@@ -381,24 +800,7 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     # ═════════════════════════════════════════════════════════════
     elements.extend(_section_header("2 - LOCALISATION DU TERRAIN", styles))
     
-    ter = dp.terrain
-    elements.append(_field_row("Adresse du terrain :", f"{ter.adresse}, {ter.code_postal} {ter.commune}", styles))
-    if ter.lieu_dit:
-        elements.append(_field_row("Lieu-dit :", ter.lieu_dit, styles))
-    elements.append(_field_row("References cadastrales :", f"Section {ter.section_cadastrale}, Parcelle n {ter.numero_parcelle}", styles))
-    elements.append(_field_row("Superficie :", f"{ter.superficie_terrain} m2", styles))
-    elements.append(_field_row("Zone PLU :", ter.zone_plu, styles))
-    
-    situations = []
-    if ter.est_lotissement:
-        situations.append("Terrain situe dans un lotissement")
-    if ter.est_zone_protegee:
-        situations.append("Zone protegee")
-    if ter.est_monument_historique:
-        situations.append("Perimetre de monument historique")
-    if not situations:
-        situations.append("Aucune situation particuliere")
-    elements.append(_field_row("Situation particuliere :", " - ".join(situations), styles))
+    elements.append(_field_rows(_spec_rows(dp.terrain, _TERRAIN_FIELDS), styles))
     
     elements.append(Spacer(1, 5 * mm))
     
@@ -407,17 +809,7 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     # ═════════════════════════════════════════════════════════════
     elements.extend(_section_header("3 - NATURE ET IMPORTANCE DES TRAVAUX", styles))
     
-    trv = dp.travaux
-    elements.append(_field_row("Type de travaux :", trv.type_travaux, styles))
-    elements.append(_field_row("Description :", trv.description_courte, styles))
-    elements.append(_field_row("Surface plancher existante :", f"{trv.surface_plancher_existante} m2", styles))
-    elements.append(_field_row("Surface plancher creee :", f"{trv.surface_plancher_creee} m2", styles))
-    elements.append(_field_row("Emprise au sol existante :", f"{trv.emprise_au_sol_existante} m2", styles))
-    elements.append(_field_row("Emprise au sol creee :", f"{trv.emprise_au_sol_creee} m2", styles))
-    elements.append(_field_row("Hauteur existante :", f"{trv.hauteur_existante} m", styles))
-    elements.append(_field_row("Hauteur projetee :", f"{trv.hauteur_projetee} m", styles))
-    elements.append(_field_row("Date debut prevue :", trv.date_debut_prevue, styles))
-    elements.append(_field_row("Duree estimee :", f"{trv.duree_travaux_mois} mois", styles))
+    elements.append(_field_rows(_spec_rows(dp.travaux, _TRAVAUX_FIELDS), styles))
     
     elements.append(PageBreak())
     
@@ -428,23 +820,9 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     
     asp = dp.aspect_exterieur
     
-    elements.append(Paragraph("Ouvertures et Menuiseries", styles['SousSectionTitre']))
-    elements.append(_field_row("Nombre existant :", asp.nombre_ouvertures_existantes or "—", styles, theme))
-    elements.append(_field_row("Nombre projete :", asp.nombre_ouvertures_projetees or "—", styles, theme))
-    elements.append(_field_row("Types existants :", asp.menuiseries_existantes or "—", styles, theme))
-    elements.append(_field_row("Types projetes :", asp.menuiseries_projetees or "—", styles, theme))
-
-    elements.append(Paragraph("Facades", styles['SousSectionTitre']))
-    elements.append(_field_row("Materiaux existants :", asp.facade_materiaux_existants or "—", styles, theme))
-    elements.append(_field_row("Materiaux projetes :", asp.facade_materiaux_projetes or "—", styles, theme))
-    
-    elements.append(Paragraph("Toiture", styles['SousSectionTitre']))
-    elements.append(_field_row("Materiaux existants :", asp.toiture_materiaux_existants or "—", styles, theme))
-    elements.append(_field_row("Materiaux projetes :", asp.toiture_materiaux_projetes or "—", styles, theme))
-    
-    elements.append(Paragraph("Cloture", styles['SousSectionTitre']))
-    elements.append(_field_row("Existante :", asp.cloture_existante or "—", styles, theme))
-    elements.append(_field_row("Projetee :", asp.cloture_projetee or "—", styles, theme))
+    for sous_titre, specs in _ASPECT_GROUPS:
+        elements.append(Paragraph(sous_titre, styles['SousSectionTitre']))
+        elements.append(_field_rows(_spec_rows(asp, specs), styles))
     
     elements.append(Paragraph("Palette de couleurs", styles['SousSectionTitre']))
     
@@ -486,11 +864,7 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     
     elements.append(Paragraph("5.3 - Analyse technique estimee", styles['SousSectionTitre']))
     elements.append(Paragraph(notice.modifications_detaillees or "—", styles['CorpsTexte']))
-    elements.append(_field_row("Surface plancher :", notice.modification_surface_plancher or "—", styles, theme))
-    elements.append(_field_row("Emprise au sol :", notice.modification_emprise_au_sol or "—", styles, theme))
-    elements.append(_field_row("Volume :", notice.modification_volume or "—", styles, theme))
-    elements.append(_field_row("Hauteur existante :", notice.hauteur_estimee_existante or "—", styles, theme))
-    elements.append(_field_row("Hauteur projetee :", notice.hauteur_estimee_projete or "—", styles, theme))
+    elements.append(_field_rows(_spec_rows(notice, _NOTICE_TECH_FIELDS), styles))
     
     elements.append(Paragraph("5.4 - Analyse reglementaire", styles['SousSectionTitre']))
     elements.append(Paragraph(f"Coherence architecturale (Zone {dp.terrain.zone_plu}) :", styles['SousSectionTitre']))
@@ -513,21 +887,38 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     # ═════════════════════════════════════════════════════════════
     # SECTION 6 : PHOTOGRAPHIES — Comparaison avant/après
     # ═════════════════════════════════════════════════════════════
-    elements.extend(_section_header("6 - REPORTAGE PHOTOGRAPHIQUE - COMPARAISON AVANT/APRES", styles, theme))
+    elements.extend(_section_header("6 - REPORTAGE PHOTOGRAPHIQUE - COMPARAISON AVANT/APRES", styles))
     
     col_width = 82 * mm  # Width for each photo column
     max_img_height = 90 * mm
     
+    # Résolution + réduction de toutes les photos en parallèle (décodage JPEG hors GIL)
+    photo_w_mm, photo_h_mm = (col_width - 4*mm) / mm, max_img_height / mm
+
+    listings = {}  # listings de répertoires, propres à ce document
+
+    def _prepare(chemin):
+        path = _resolve_photo_path(chemin, listings)
+        return _prepare_photo(path, photo_w_mm, photo_h_mm, dpi=max_dpi, quality=quality) if path else None
+
+    chemins = [c for ps in dp.photo_sets for c in (ps.chemin_avant, ps.chemin_apres)]
+    uniques = list(dict.fromkeys(chemins))  # une même photo peut figurer dans plusieurs comparaisons
+    if uniques:
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1, len(uniques))) as ex:
+            par_chemin = dict(zip(uniques, ex.map(_prepare, uniques)))
+    else:
+        par_chemin = {}
+    prepared = [par_chemin[c] for c in chemins]
+    
     for i, photo_set in enumerate(dp.photo_sets):
         # Set label header
-        elements.append(Paragraph(
+        set_header = Paragraph(
             f"Comparaison {i+1} : {photo_set.label}",
             styles['SousSectionTitre']
-        ))
+        )
         
         # Build side-by-side table
-        avant_path = _resolve_photo_path(photo_set.chemin_avant)
-        apres_path = _resolve_photo_path(photo_set.chemin_apres)
+        avant_path, apres_path = prepared[2 * i], prepared[2 * i + 1]
         
         # Header row
         header_row = [
@@ -536,8 +927,8 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
         ]
         
         # Image row
-        img_avant = _fit_image(avant_path, col_width - 4*mm, max_img_height) if avant_path else Paragraph("[Pas de photo avant]", styles['Champ'])
-        img_apres = _fit_image(apres_path, col_width - 4*mm, max_img_height) if apres_path else Paragraph("[Pas de photo apres]", styles['Champ'])
+        img_avant = _fit_image(avant_path, col_width - 4*mm, max_img_height, styles) if avant_path else Paragraph("[Pas de photo avant]", styles['Champ'])
+        img_apres = _fit_image(apres_path, col_width - 4*mm, max_img_height, styles) if apres_path else Paragraph("[Pas de photo apres]", styles['Champ'])
         img_row = [img_avant, img_apres]
         
         # Caption row
@@ -566,12 +957,8 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
             ('LINEBELOW', (0, 0), (-1, 0), 0.5, theme["border"]),
         ]))
         
-        elements.append(comparison_table)
-        elements.append(Spacer(1, 8 * mm))
-        
-        # Page break between sets (except last)
-        if i < len(dp.photo_sets) - 1:
-            elements.append(PageBreak())
+        # Bloc insécable : la comparaison passe à la page suivante seulement si elle ne tient pas
+        elements.append(KeepTogether([set_header, comparison_table, Spacer(1, 8 * mm)]))
     
     if not dp.photo_sets:
         elements.append(Paragraph("Aucune photographie fournie.", styles['CorpsTexte']))
@@ -581,7 +968,7 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     # ═════════════════════════════════════════════════════════════
     # SECTION 7 : INDEX DES PIÈCES JOINTES
     # ═════════════════════════════════════════════════════════════
-    elements.extend(_section_header("7 - INDEX DES PIECES JOINTES", styles, theme))
+    elements.extend(_section_header("7 - INDEX DES PIECES JOINTES", styles))
     
     elements.append(Paragraph(
         "Liste des pieces constitutives du dossier conformement aux articles "
@@ -590,52 +977,45 @@ def generer_pdf(dp: DeclarationPrealable, output_path: str = None, output_dir: s
     ))
     elements.append(Spacer(1, 3 * mm))
     
-    pieces_data = [["Ref.", "Designation", "Statut"]]
-    for ref, info in dp.pieces_jointes.items():
-        statut = "Fourni" if info["fourni"] else "Non fourni"
-        pieces_data.append([ref, info["nom"], statut])
-    
-    pieces_table = Table(pieces_data, colWidths=[18 * mm, 120 * mm, 32 * mm], hAlign='LEFT')
-    pieces_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BACKGROUND', (0, 0), (-1, 0), theme["primary"]),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('TEXTCOLOR', (0, 1), (-1, -1), theme["text_title"]),
-        ('LINEBELOW', (0, 0), (-1, -1), 0.3, theme["border"]),
-        ('TOPPADDING', (0, 0), (-1, -1), 4),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-        ('LEFTPADDING', (0, 0), (-1, -1), 4),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, theme["bg_light"]]),
-    ]))
-    elements.append(pieces_table)
+    elements.append(_pieces_table(dp.pieces_jointes, styles))
     
     elements.append(Spacer(1, 15 * mm))
     
     # Signature
-    elements.append(HRFlowable(width="100%", thickness=0.5, color=theme["border"], spaceAfter=5 * mm))
-    elements.append(Paragraph(
-        f"Fait a {dp.terrain.commune}, le {dp.date_creation}",
-        ParagraphStyle('Signature', fontName='Helvetica', fontSize=10,
-                       textColor=theme["text_title"], alignment=TA_LEFT, spaceAfter=15 * mm)
-    ))
-    elements.append(Paragraph(
-        f"Le demandeur : {dp.demandeur.civilite} {dp.demandeur.prenom} {dp.demandeur.nom}",
-        ParagraphStyle('SignatureNom', fontName='Helvetica-Bold', fontSize=10,
-                       textColor=theme["text_title"], alignment=TA_LEFT, spaceAfter=3 * mm)
-    ))
-    elements.append(Paragraph(
-        "Signature :",
-        ParagraphStyle('SignatureLabel', fontName='Helvetica', fontSize=9,
-                       textColor=theme["text_body"], alignment=TA_LEFT)
+    elements.extend(copy.copy(f) for f in _signature_block(
+        theme_name, dp.terrain.commune, dp.date_creation,
+        dp.demandeur.civilite, dp.demandeur.prenom, dp.demandeur.nom,
     ))
     
     # ── Build ──
     doc.build(elements, onFirstPage=template.header_footer, onLaterPages=template.header_footer)
+
+    if to_file:
+        _write_file(filepath, buf.getbuffer())
     
     return filepath
 
 
+def generer_pdfs_batch(dps: list, output_dir: str = "output", theme_name: str = "classique",
+                       max_workers: int = None) -> list:
+    """
+    Génère plusieurs dossiers PDF en parallèle, un processus par cœur
+    (le rendu ReportLab est limité par le CPU et le GIL).
+    
+    Args:
+        dps: Liste d'objets DeclarationPrealable
+        output_dir: Répertoire de sortie commun
+        theme_name: Thème visuel appliqué à tous les dossiers
+        max_workers: Nombre de processus (par défaut : nombre de cœurs)
+        
+    Returns:
+        Chemins des PDF générés, dans l'ordre de `dps`
+    """
+    render = partial(generer_pdf, output_dir=output_dir, theme_name=theme_name)
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        return list(ex.map(render, dps))
+
+
 # ─── Script de test direct ─────────────────────────────────────────
 if __name__ == "__main__":
     from models import get_dummy_declaration